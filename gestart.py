@@ -1,8 +1,19 @@
 import sys
 import os
 import random
+import re
 import logging
 import json
+import sqlite3
+import hashlib
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import quote
 from send2trash import send2trash
 
 from PyQt6.QtWidgets import (
@@ -14,11 +25,13 @@ from PyQt6.QtWidgets import (
 )
 from PyQt6.QtGui import (
     QPixmap, QImage, QTransform, QPainter, QShortcut, QKeySequence, QPen, QColor, 
-    QLinearGradient, QIcon, QPalette, QDesktopServices, QPainterPath
+    QLinearGradient, QIcon, QPalette, QDesktopServices, QPainterPath, QImageReader,
+    QStaticText, QFont, QFontMetrics
 )
 from PyQt6.QtCore import (
     QTimer, Qt, pyqtSignal, QThread, QPointF, QSize, pyqtProperty,
-    QPropertyAnimation, QEasingCurve, QEvent, QRect, QMargins, QRectF, QUrl
+    QPropertyAnimation, QEasingCurve, QEvent, QRect, QMargins, QRectF, QUrl,
+    QObject, QFileSystemWatcher, QRunnable, QThreadPool, QSizeF
 )
 from PyQt6.QtSvg import QSvgRenderer
 from PyQt6.QtMultimedia import QMediaPlayer, QAudioOutput
@@ -160,6 +173,19 @@ def get_font_size_for_language(language_code):
 # Кэш для иконок
 _icon_cache = {}
 
+# Цвет из строки темы в QColor: QColor не понимает формат rgba(...) из стилей
+def theme_qcolor(value, default):
+    """QColor from a theme colour string: #rrggbb, rgba(r, g, b, a) with alpha 0-255, or a name"""
+    if value.startswith('rgba'):
+        try:
+            r, g, b, a = (int(float(part)) for part in value[value.index('(') + 1:value.rindex(')')].split(','))
+            return QColor(r, g, b, a)
+        except ValueError:
+            logging.warning(f"Color conversion error: {value}")
+            return QColor(default)
+    color = QColor(value)
+    return color if color.isValid() else QColor(default)
+
 # Функция для создания иконок в соответствии с темой
 def create_themed_icon(icon_path):
     # Проверяем кэш
@@ -230,12 +256,143 @@ def create_themed_icon(icon_path):
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+def write_file_atomic(path, text):
+    """Writes text to a temporary file next to path and renames it over path"""
+    # Свое имя временного файла у каждого писателя, иначе параллельные записи портят друг друга
+    temp_file = f"{path}.gestart-{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, path)
+    except OSError:
+        try:
+            os.remove(temp_file)
+        except OSError:
+            pass
+        raise
+
+def fsync_file(path):
+    """Forces data written to path through another handle onto the disk"""
+    # Без O_CREAT: уже удаленный файл не воссоздаем; запись нужна FlushFileBuffers в Windows
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# Фоновая запись файлов конфигурации
+class PersistenceWorker:
+    """Writes config files on a background thread.
+
+    Repeated writes of the same file within COALESCE_DELAY replace each
+    other, so only the last version reaches the disk; `coalesced` counts
+    the writes saved that way. Every write is atomic (temp file + rename).
+    sync() queues an fsync of a file appended to elsewhere (the history
+    journal) and is coalesced the same way, so the disk flush happens here
+    and at most once per COALESCE_DELAY instead of on the caller's thread.
+    """
+    COALESCE_DELAY = 0.5
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = {}  # path -> (text, время записи)
+        self.writing = False
+        self.running = True
+        self.thread = None
+        self.writes = 0
+        self.coalesced = 0
+
+    def submit(self, path, text):
+        with self.condition:
+            if not self.running:
+                # Воркер уже остановлен - пишем сразу
+                self.write(path, text)
+                return
+            if path in self.pending:
+                if text is not None:
+                    self.coalesced += 1
+                due = self.pending[path][1]
+            else:
+                due = time.monotonic() + self.COALESCE_DELAY
+            self.pending[path] = (text, due)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="gestart-persistence", daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def sync(self, path):
+        self.submit(path, None)
+
+    def write(self, path, text):
+        try:
+            if text is None:
+                fsync_file(path)
+            else:
+                write_file_atomic(path, text)
+                self.writes += 1
+        except FileNotFoundError:
+            pass  # Журнал успели свернуть и удалить - его строки уже в снимке
+        except OSError as e:
+            logging.error(f"Error writing {path}: {e}")
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                now = time.monotonic()
+                ready = [path for path, (_, due) in self.pending.items() if due <= now or not self.running]
+                if not ready:
+                    self.condition.wait(min(due for _, due in self.pending.values()) - now)
+                    continue
+                items = [(path, self.pending.pop(path)[0]) for path in ready]
+                self.writing = True
+            for path, text in items:
+                self.write(path, text)
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+    def flush(self, timeout=5):
+        """Writes everything pending now and waits for it"""
+        with self.condition:
+            if not self.pending and not self.writing:
+                return
+            for path, (text, _) in list(self.pending.items()):
+                self.pending[path] = (text, 0)
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: not self.pending and not self.writing, timeout)
+
+    def stop(self):
+        self.flush()
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(5)
+
 class ConfigManager:
+    # После стольких записей журнал сворачивается в новый снимок history.json
+    HISTORY_COMPACT_LINES = 5000
+
     def __init__(self):
         self.config_dir = os.path.join(os.path.expanduser("~"), ".gestart")
         self.settings_file = os.path.join(self.config_dir, "settings.json")
         self.history_file = os.path.join(self.config_dir, "history.json")
+        # Журнал изменений истории поверх снимка history.json, одна запись на строку
+        self.history_journal_file = os.path.join(self.config_dir, "history.log")
+        self.history_journal = None
+        self.history_journal_lines = 0
+        self.history_compaction = None
+        # Снимок history.json пишет только write_history_snapshot, по одному за раз
+        self.history_snapshot_lock = threading.Lock()
         self.folder_stats_file = os.path.join(self.config_dir, "folder_stats.json")
+        self.library_index_file = os.path.join(self.config_dir, "library.db")
+        self.persistence = PersistenceWorker()
         self.ensure_config_dir()
         
     def ensure_config_dir(self):
@@ -244,12 +401,12 @@ class ConfigManager:
             os.makedirs(self.config_dir)
             
     def save_settings(self, settings):
-        """Saves settings to JSON file"""
-        with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, ensure_ascii=False, indent=4)
+        """Saves settings to JSON file in the background"""
+        self.persistence.submit(self.settings_file, json.dumps(settings, ensure_ascii=False, indent=4))
             
     def load_settings(self):
         """Загружает настройки из файла"""
+        self.persistence.flush()
         default_settings = {
             "folder": "",
             "display_time": 30,
@@ -268,8 +425,14 @@ class ConfigManager:
             "confirm_delete": True,
             "grid_h_lines": 2,
             "grid_v_lines": 2,
+            "grid_diagonals": False,
             "timer_volume": 50,
-            "theme": "dark"
+            "theme": "dark",
+            "scan_workers": 4,
+            # Число потоков сканирования для отдельных папок/точек монтирования: {"/mnt/nas": 16}
+            "scan_workers_overrides": {},
+            "pixmap_cache_mb": 0,  # 0 - определяется по объему свободной памяти
+            "disk_cache_mb": 1024  # 0 - дисковый кэш изображений отключен
         }
         
         if os.path.exists(self.settings_file):
@@ -293,88 +456,375 @@ class ConfigManager:
             
         return default_settings
         
-    def save_history(self, history):
-        """Saves viewed images history to JSON file"""
-        with open(self.history_file, 'w', encoding='utf-8') as f:
-            json.dump(list(history), f, ensure_ascii=False, indent=4)
-            
+    def append_history(self, history, path):
+        """Records a viewed image in the history journal"""
+        self.write_history_journal(history, "+" + json.dumps(path, ensure_ascii=False))
+
+    def remove_from_history(self, history, path):
+        """Records removal of an image from the history"""
+        self.write_history_journal(history, "-" + json.dumps(path, ensure_ascii=False))
+
+    def clear_history(self, history):
+        """Records that the history was cleared"""
+        self.write_history_journal(history, "!")
+
+    def write_history_journal(self, history, line):
+        """Appends one line to history.log; the whole history is never rewritten here"""
+        try:
+            if self.history_journal is None:
+                self.history_journal = open(self.history_journal_file, 'a', encoding='utf-8')
+                if self.history_journal.tell() and not self.journal_ends_with_newline():
+                    # Оборванная при сбое строка не должна склеиться с новой записью
+                    self.history_journal.write("\n")
+            self.history_journal.write(line + "\n")
+            # Строка сразу уходит в ОС, поэтому падение программы ее не теряет;
+            # fsync на случай отключения питания делает фоновый поток
+            self.history_journal.flush()
+            self.persistence.sync(self.history_journal_file)
+            self.history_journal_lines += 1
+        except OSError as e:
+            logging.error(f"Error writing history journal: {e}")
+            return
+        if self.history_journal_lines >= max(self.HISTORY_COMPACT_LINES, len(history)):
+            self.compact_history(history)
+
+    def journal_ends_with_newline(self):
+        with open(self.history_journal_file, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def close_history_journal(self):
+        if self.history_journal is not None:
+            try:
+                self.history_journal.close()
+            except OSError as e:
+                logging.error(f"Error closing history journal: {e}")
+            self.history_journal = None
+
+    def replay_history_journal(self, journal_file, history):
+        """Applies journal lines to the history dict, returns the number of lines"""
+        if not os.path.exists(journal_file):
+            return 0
+        count = 0
+        with open(journal_file, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                count += 1
+                action, value = line[:1], line[1:].rstrip("\n")
+                if action == "!":
+                    history.clear()
+                    continue
+                try:
+                    path = json.loads(value)
+                except ValueError:
+                    # Строка, оборванная при сбое, - пропускаем ее
+                    logging.warning(f"Skipping damaged history journal line {count} in {journal_file}")
+                    continue
+                if action == "+":
+                    history.setdefault(path)
+                elif action == "-":
+                    history.pop(path, None)
+        return count
+
     def load_history(self):
-        """Loads viewed images history from JSON file"""
+        """Loads viewed images history: the history.json snapshot with the journal replayed on top"""
+        # Идущее сжатие сначала дописываем, иначе его history.log.old выглядит как прерванное
+        if self.history_compaction is not None:
+            self.history_compaction.join()
+            self.history_compaction = None
+        history = {}  # dict как упорядоченное множество
         if os.path.exists(self.history_file):
-            with open(self.history_file, 'r', encoding='utf-8') as f:
-                return list(json.load(f))
-        return []
+            try:
+                with open(self.history_file, 'r', encoding='utf-8') as f:
+                    history = dict.fromkeys(json.load(f))
+            except (OSError, ValueError) as e:
+                logging.error(f"Error loading history file {self.history_file}: {e}")
+
+        old_journal = self.history_journal_file + ".old"
+        interrupted = os.path.exists(old_journal)
+        try:
+            self.history_journal_lines = (self.replay_history_journal(old_journal, history) +
+                                          self.replay_history_journal(self.history_journal_file, history))
+        except OSError as e:
+            logging.error(f"Error reading history journal: {e}")
+
+        if interrupted:
+            # Прошлое сжатие не завершилось - дописываем снимок сразу, пока журналы целы
+            self.close_history_journal()
+            if self.write_history_snapshot(list(history), old_journal):
+                try:
+                    os.remove(self.history_journal_file)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.error(f"Error removing history journal: {e}")
+                self.history_journal_lines = 0
+        elif self.history_journal_lines >= max(self.HISTORY_COMPACT_LINES, len(history)):
+            self.compact_history(history)
+        return list(history)
+
+    def compact_history(self, history):
+        """Folds the journal into a new history.json snapshot in a background thread"""
+        if self.history_compaction is not None and self.history_compaction.is_alive():
+            return
+        old_journal = self.history_journal_file + ".old"
+        if os.path.exists(old_journal):
+            return
+        snapshot = list(history)
+        # Новые записи пойдут в свежий журнал, старый удаляется после записи снимка
+        self.close_history_journal()
+        try:
+            if os.path.exists(self.history_journal_file):
+                os.replace(self.history_journal_file, old_journal)
+        except OSError as e:
+            logging.error(f"Error rotating history journal: {e}")
+            return
+        self.history_journal_lines = 0
+        self.history_compaction = threading.Thread(
+            target=self.write_history_snapshot, args=(snapshot, old_journal),
+            name="gestart-history-compaction", daemon=True
+        )
+        self.history_compaction.start()
+
+    def write_history_snapshot(self, snapshot, old_journal=None):
+        """Atomically replaces history.json and drops the journal it already contains"""
+        with self.history_snapshot_lock:
+            try:
+                write_file_atomic(self.history_file, json.dumps(snapshot, ensure_ascii=False))
+                if old_journal and os.path.exists(old_journal):
+                    os.remove(old_journal)
+                return True
+            except OSError as e:
+                logging.error(f"Error writing history snapshot: {e}")
+                return False
+
+    def close_history(self):
+        """Finishes a running compaction and closes the journal"""
+        if self.history_compaction is not None:
+            self.history_compaction.join(5)
+        self.close_history_journal()
+
+    def close(self):
+        """Flushes pending writes; called when the application closes"""
+        self.close_history()
+        self.persistence.stop()
+        logging.info(f"Config files written: {self.persistence.writes}, "
+                     f"writes saved by coalescing: {self.persistence.coalesced}")
 
     def save_folder_stats(self, folder_stats):
-        """Saves viewing statistics for each folder"""
-        with open(self.folder_stats_file, 'w', encoding='utf-8') as f:
-            json.dump(folder_stats, f, ensure_ascii=False, indent=4)
+        """Saves viewing statistics for each folder in the background"""
+        self.persistence.submit(self.folder_stats_file, json.dumps(folder_stats, ensure_ascii=False, indent=4))
 
     def load_folder_stats(self):
         """Loads viewing statistics for each folder"""
+        self.persistence.flush()
         if os.path.exists(self.folder_stats_file):
             with open(self.folder_stats_file, 'r', encoding='utf-8') as f:
                 return json.load(f)
         return {}
 
+# Постоянный индекс библиотеки: хранит состояние каждой папки между запусками
+class LibraryIndex:
+    """Persistent SQLite index of scanned folders, keyed by folder root.
+
+    Every directory row keeps its mtime, the names of its image files and
+    the names of its subdirectories, so a rescan only lists directories
+    whose mtime has changed since the previous scan.
+    """
+
+    # Имена файлов не могут содержать NUL, поэтому используем его как разделитель
+    SEPARATOR = "\0"
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def connect(self):
+        """Opens a connection; each thread must use its own one"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS directories (
+                root TEXT NOT NULL,
+                path TEXT NOT NULL,
+                mtime INTEGER NOT NULL,
+                files TEXT NOT NULL,
+                subdirs TEXT NOT NULL,
+                PRIMARY KEY (root, path)
+            )
+        """)
+        return conn
+
+    def _split(self, value):
+        return value.split(self.SEPARATOR) if value else []
+
+    def load(self, root):
+        """Returns {directory: (mtime_ns, [image names], [subdir names])} for the root"""
+        directories = {}
+        try:
+            conn = self.connect()
+            try:
+                rows = conn.execute(
+                    "SELECT path, mtime, files, subdirs FROM directories WHERE root = ?",
+                    (root,)
+                )
+                for path, mtime, files, subdirs in rows:
+                    directories[path] = (mtime, self._split(files), self._split(subdirs))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.warning(f"Error loading library index for {root}: {e}")
+        return directories
+
+    def update(self, root, changed, removed):
+        """Writes changed directory rows and drops the ones that disappeared"""
+        if not changed and not removed:
+            return
+        try:
+            conn = self.connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO directories (root, path, mtime, files, subdirs) VALUES (?, ?, ?, ?, ?)",
+                        [(root, path, mtime, self.SEPARATOR.join(files), self.SEPARATOR.join(subdirs))
+                         for path, (mtime, files, subdirs) in changed.items()]
+                    )
+                    conn.executemany(
+                        "DELETE FROM directories WHERE root = ? AND path = ?",
+                        [(root, path) for path in removed]
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.warning(f"Error updating library index for {root}: {e}")
+
 # Асинхронный сканер папки для повышения производительности
 class FolderScannerThread(QThread):
-    scanned = pyqtSignal(list)
+    scanned = pyqtSignal(list)    # Очередная порция найденных изображений
+    removed = pyqtSignal(list)    # Изображения из индекса, которых больше нет на диске
+    completed = pyqtSignal(int)   # Сканирование завершено, передается общее число изображений
     error = pyqtSignal(str)
-    progress = pyqtSignal(int, int)
+    progress = pyqtSignal(int, int)  # Просмотрено папок, найдено изображений
+
+    # Порции отправляются каждые BATCH_SIZE файлов или BATCH_INTERVAL секунд
+    BATCH_SIZE = 2000
+    BATCH_INTERVAL = 0.1
 
-    def __init__(self, folder, supported_extensions, parent=None):
+    def __init__(self, folder, supported_extensions, library_index=None, workers=1, parent=None):
         super().__init__(parent)
         self.folder = folder
         self.supported_extensions = supported_extensions
+        self.library_index = library_index
+        self.workers = max(1, workers)  # Сколько папок читается одновременно
         self.is_running = True
+        self.root = None
+        self.directories = {}  # Результат сканирования, передается FolderWatcher
+        self.pending_files = []
+        self.dirs_visited = 0
+        self.images_found = 0
+        self.last_report = 0.0
 
     def stop(self):
         self.is_running = False
 
-    def count_total_files(self, folder):
-        total = 0
-        try:
-            with os.scandir(folder) as it:
-                for entry in it:
-                    if not self.is_running:
-                        return 0
-                    if entry.is_file():
-                        total += 1
+    def report(self, force=False):
+        """Sends the accumulated batch and progress, throttled by size and time"""
+        now = time.monotonic()
+        if not force and len(self.pending_files) < self.BATCH_SIZE and now - self.last_report < self.BATCH_INTERVAL:
+            return
+        if self.pending_files:
+            self.scanned.emit(self.pending_files)
+            self.pending_files = []
+        self.progress.emit(self.dirs_visited, self.images_found)
+        self.last_report = now
+
+    def list_directory(self, folder, mtime):
+        """Reads a single directory: returns (mtime, image names, subdirectory names)"""
+        files = []
+        subdirs = []
+        with os.scandir(folder) as it:
+            for entry in it:
+                try:
+                    if entry.name.lower().endswith(self.supported_extensions) and entry.is_file():
+                        files.append(entry.name)
                     elif entry.is_dir():
-                        total += self.count_total_files(entry.path)
-        except Exception:
-            pass
-        return total
-
-    def scan_folder(self, folder, image_files, processed_files, total_files):
-        try:
-            with os.scandir(folder) as it:
-                for entry in it:
-                    if not self.is_running:
-                        return
-                        
-                    try:
-                        if entry.is_file():
-                            if entry.name.lower().endswith(self.supported_extensions):
-                                full_path = os.path.join(folder, entry.name)
-                                if os.access(full_path, os.R_OK):
-                                    image_files.append(full_path)
-                        elif entry.is_dir():
-                            self.scan_folder(entry.path, image_files, processed_files, total_files)
-                    except Exception as e:
-                        logging.warning(f"Error processing {entry.name}: {e}")
-                        continue
-                        
-                    processed_files[0] += 1
-                    if processed_files[0] % 10 == 0:
-                        self.progress.emit(processed_files[0], total_files)
-                        
-        except Exception as e:
-            logging.warning(f"Error scanning folder {folder}: {e}")
+                        subdirs.append(entry.name)
+                except OSError as e:
+                    logging.warning(f"Error processing {entry.name}: {e}")
+        return mtime, files, subdirs
+
+    def read_directory(self, folder, cached_entry):
+        """Stats a directory and lists it unless the index entry is still valid"""
+        stat = os.stat(folder)
+        if cached_entry is not None and cached_entry[0] == stat.st_mtime_ns:
+            # Папка не менялась с прошлого сканирования - берем ее содержимое из индекса
+            return (stat.st_dev, stat.st_ino), cached_entry
+        return (stat.st_dev, stat.st_ino), self.list_directory(folder, stat.st_mtime_ns)
+
+    def add_directory(self, folder, entry, cached_entry, directories):
+        """Records a scanned directory and returns paths of its subdirectories"""
+        directories[folder] = entry
+        _, files, subdirs = entry
+        if entry is not cached_entry:
+            known = set(cached_entry[1]) if cached_entry else ()
+            self.pending_files.extend(os.path.join(folder, name) for name in files if name not in known)
+        self.dirs_visited += 1
+        self.images_found += len(files)
+        return [os.path.join(folder, name) for name in subdirs]
+
+    def scan_folder(self, root, cached, directories):
+        """Walks the tree once, reusing index entries of directories whose mtime didn't change"""
+        visited = set()  # (st_dev, st_ino) - защита от циклов через символические ссылки
+        stack = [root]
+        while stack:
+            if not self.is_running:
+                return
+            folder = stack.pop()
+            cached_entry = cached.get(folder)
+            try:
+                key, entry = self.read_directory(folder, cached_entry)
+            except OSError as e:
+                logging.warning(f"Error scanning folder {folder}: {e}")
+                continue
+            if key in visited:
+                continue
+            visited.add(key)
+            stack.extend(reversed(self.add_directory(folder, entry, cached_entry, directories)))
+            self.report()
+
+    def scan_folder_parallel(self, root, cached, directories):
+        """Same walk as scan_folder, but reads up to self.workers directories at once.
+
+        Useful on network mounts, where every os.scandir call is mostly latency.
+        """
+        visited = set()
+        queue = deque([root])
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="gestart-scan") as executor:
+            try:
+                while (queue or in_flight) and self.is_running:
+                    # Держим очередь пула ограниченной, остальное ждет в queue
+                    while queue and len(in_flight) < self.workers * 2:
+                        folder = queue.popleft()
+                        future = executor.submit(self.read_directory, folder, cached.get(folder))
+                        in_flight[future] = folder
+
+                    done, _ = wait(in_flight, timeout=self.BATCH_INTERVAL, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        folder = in_flight.pop(future)
+                        try:
+                            key, entry = future.result()
+                        except OSError as e:
+                            logging.warning(f"Error scanning folder {folder}: {e}")
+                            continue
+                        if key in visited:
+                            continue
+                        visited.add(key)
+                        queue.extend(self.add_directory(folder, entry, cached.get(folder), directories))
+                    self.report()
+            finally:
+                # При остановке не начинаем чтение папок, которые еще ждут в пуле
+                for future in in_flight:
+                    future.cancel()
 
     def run(self):
-        image_files = []
         try:
             if not os.path.exists(self.folder):
                 self.error.emit(tr("Folder does not exist") + f": {self.folder}")
@@ -384,23 +834,276 @@ class FolderScannerThread(QThread):
                 self.error.emit(tr("No access to folder") + f": {self.folder}")
                 return
 
-            # Count total number of files for progress tracking
-            total_files = self.count_total_files(self.folder)
-            processed_files = [0]  # Using list for pass by reference
-            
-            # Start recursive scanning
-            self.scan_folder(self.folder, image_files, processed_files, total_files)
+            root = self.root = os.path.abspath(self.folder)
+            cached = self.library_index.load(root) if self.library_index else {}
+
+            # Сразу отдаем список из индекса, новые файлы придут следующими порциями
+            cached_files = []
+            for path, (_, files, _) in cached.items():
+                cached_files.extend(os.path.join(path, name) for name in files)
+            if cached_files:
+                self.scanned.emit(cached_files)
+            self.last_report = time.monotonic()
+
+            directories = self.directories
+            if self.workers > 1:
+                self.scan_folder_parallel(root, cached, directories)
+            else:
+                self.scan_folder(root, cached, directories)
             
-            if self.is_running:
-                if not image_files:
-                    self.error.emit(tr("No images found in selected folder and subfolders"))
-                else:
-                    self.scanned.emit(image_files)
+            if not self.is_running:
+                return
+            self.report(force=True)
+
+            removed_files = []
+            for path, (_, files, _) in cached.items():
+                entry = directories.get(path)
+                if entry is None:
+                    removed_files.extend(os.path.join(path, name) for name in files)
+                elif entry is not cached[path]:
+                    current = set(entry[1])
+                    removed_files.extend(os.path.join(path, name) for name in files if name not in current)
+            if removed_files:
+                self.removed.emit(removed_files)
+
+            if self.library_index:
+                changed = {path: entry for path, entry in directories.items() if cached.get(path) is not entry}
+                vanished = [path for path in cached if path not in directories]
+                self.library_index.update(root, changed, vanished)
+
+            if not self.images_found:
+                self.error.emit(tr("No images found in selected folder and subfolders"))
+            self.completed.emit(self.images_found)
                     
         except Exception as e:
             self.error.emit(tr("Error") + f": {e}")
             logging.error(f"Error scanning folder: {e}")
 
+# Обновление отдельных папок по уведомлениям от FolderWatcher
+class FolderRefreshThread(FolderScannerThread):
+    """Rereads directories reported by FolderWatcher and works out the delta.
+
+    Only the given directories are listed; subdirectories that appeared are
+    walked in full, the ones that vanished are dropped with all their
+    descendants. New files go out through `scanned`, missing ones through
+    `removed`, and `refreshed` carries the changed directory entries and the
+    removed directory paths for the watcher and the library index.
+    """
+    refreshed = pyqtSignal(dict, list)
+
+    def __init__(self, root, folders, known, supported_extensions, library_index=None, parent=None):
+        super().__init__(root, supported_extensions, library_index, parent=parent)
+        self.root = root
+        self.folders = folders
+        # Снимок FolderWatcher.directories, сделанный при запуске потока
+        self.known = known
+
+    def run(self):
+        try:
+            changed = {}
+            gone = []
+            removed_files = []
+            self.last_report = time.monotonic()
+            for folder in self.folders:
+                if not self.is_running:
+                    return
+                known_entry = self.known.get(folder)
+                if known_entry is None:
+                    continue
+                try:
+                    _, entry = self.read_directory(folder, known_entry)
+                except OSError:
+                    gone.append(folder)
+                    continue
+                if entry is known_entry:
+                    continue
+                self.add_directory(folder, entry, known_entry, changed)
+                current = set(entry[1])
+                removed_files.extend(os.path.join(folder, name) for name in known_entry[1] if name not in current)
+
+                old_subdirs = set(known_entry[2])
+                new_subdirs = set(entry[2])
+                for name in new_subdirs - old_subdirs:
+                    self.scan_folder(os.path.join(folder, name), {}, changed)
+                gone.extend(os.path.join(folder, name) for name in old_subdirs - new_subdirs)
+                self.report()
+
+            # Исчезнувшие папки убираем вместе со всем содержимым
+            removed_dirs = []
+            seen = set()
+            stack = gone
+            while stack:
+                folder = stack.pop()
+                entry = self.known.get(folder)
+                if entry is None or folder in seen or folder in changed:
+                    continue
+                seen.add(folder)
+                removed_dirs.append(folder)
+                removed_files.extend(os.path.join(folder, name) for name in entry[1])
+                stack.extend(os.path.join(folder, name) for name in entry[2])
+
+            if not self.is_running:
+                return
+            self.report(force=True)
+            if removed_files:
+                self.removed.emit(removed_files)
+            if self.library_index:
+                self.library_index.update(self.root, changed, removed_dirs)
+            self.refreshed.emit(changed, removed_dirs)
+        except Exception as e:
+            logging.error(f"Error refreshing watched folders: {e}")
+
+# Слежение за папкой библиотеки, чтобы список изображений обновлялся без пересканирования
+class FolderWatcher(QObject):
+    """Keeps the image list of a scanned folder in sync with the disk.
+
+    The shallowest directories are watched through QFileSystemWatcher
+    (inotify on Linux) within a budget derived from the system watch limit;
+    the rest are polled in slices by mtime. Change notifications are
+    debounced and handed to a single FolderRefreshThread at a time.
+    """
+    files_added = pyqtSignal(list)
+    files_removed = pyqtSignal(list)
+    folders_changed = pyqtSignal(list)  # Папки, содержимое которых изменилось
+
+    MAX_WATCHES = 8192
+    DEBOUNCE_MS = 500
+    POLL_INTERVAL_MS = 10000
+    POLL_BATCH = 2000  # Сколько непросматриваемых папок проверяется за один тик
+
+    def __init__(self, supported_extensions, library_index=None, parent=None):
+        super().__init__(parent)
+        self.supported_extensions = supported_extensions
+        self.library_index = library_index
+        self.root = None
+        self.directories = {}
+        self.unwatched = []
+        self.poll_position = 0
+        self.pending = set()
+        self.refresh_thread = None
+        self.watch_budget = self.get_watch_budget()
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.on_directory_changed)
+
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(self.DEBOUNCE_MS)
+        self.debounce_timer.timeout.connect(self.flush_pending)
+
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(self.POLL_INTERVAL_MS)
+        self.poll_timer.timeout.connect(self.poll_unwatched)
+
+    def get_watch_budget(self):
+        """Uses at most a quarter of the inotify watch limit, other apps need it too"""
+        try:
+            with open("/proc/sys/fs/inotify/max_user_watches") as f:
+                return max(1, min(self.MAX_WATCHES, int(f.read()) // 4))
+        except (OSError, ValueError):
+            return self.MAX_WATCHES
+
+    def watch(self, root, directories):
+        """Starts watching a freshly scanned tree"""
+        self.stop()
+        self.root = root
+        self.directories = directories
+        # Мелкие уровни меняются чаще, поэтому они получают настоящие уведомления
+        ordered = sorted(directories, key=lambda path: path.count(os.sep))
+        self.unwatched = ordered[self.watch_budget:]
+        self.add_watches(ordered[:self.watch_budget])
+        logging.info(f"Watching {len(self.watcher.directories())} folders, polling {len(self.unwatched)}")
+
+    def add_watches(self, paths):
+        free = self.watch_budget - len(self.watcher.directories())
+        if free < len(paths):
+            self.unwatched.extend(paths[max(free, 0):])
+            paths = paths[:max(free, 0)]
+        if paths:
+            # Пути, которые не удалось поставить на наблюдение, опрашиваем
+            self.unwatched.extend(self.watcher.addPaths(paths))
+        if self.unwatched and not self.poll_timer.isActive():
+            self.poll_timer.start()
+
+    def stop(self):
+        self.debounce_timer.stop()
+        self.poll_timer.stop()
+        watched = self.watcher.directories()
+        if watched:
+            self.watcher.removePaths(watched)
+        if self.refresh_thread is not None:
+            self.refresh_thread.stop()
+            self.refresh_thread = None
+        self.root = None
+        self.directories = {}
+        self.unwatched = []
+        self.poll_position = 0
+        self.pending.clear()
+
+    def on_directory_changed(self, path):
+        self.pending.add(path)
+        self.debounce_timer.start()
+
+    def poll_unwatched(self):
+        if not self.unwatched:
+            self.poll_timer.stop()
+            return
+        if self.poll_position >= len(self.unwatched):
+            self.poll_position = 0
+        batch = self.unwatched[self.poll_position:self.poll_position + self.POLL_BATCH]
+        self.poll_position += len(batch)
+        self.pending.update(batch)
+        self.flush_pending()
+
+    def flush_pending(self):
+        # Одновременно работает только один поток обновления, остальное ждет его окончания
+        if self.refresh_thread is not None or not self.pending or self.root is None:
+            return
+        folders = list(self.pending)
+        self.pending.clear()
+        # Поток получает свою копию: on_refreshed и watch меняют directories, пока он работает
+        thread = FolderRefreshThread(self.root, folders, dict(self.directories),
+                                     self.supported_extensions, self.library_index, self)
+        thread.scanned.connect(self.on_files_added)
+        thread.removed.connect(self.on_files_removed)
+        thread.refreshed.connect(self.on_refreshed)
+        thread.finished.connect(self.on_refresh_finished)
+        self.refresh_thread = thread
+        thread.start()
+
+    def on_files_added(self, files):
+        if self.sender() is self.refresh_thread:
+            self.files_added.emit(files)
+
+    def on_files_removed(self, files):
+        if self.sender() is self.refresh_thread:
+            self.files_removed.emit(files)
+
+    def on_refreshed(self, changed, removed_dirs):
+        if self.sender() is not self.refresh_thread:
+            return
+        new_dirs = [path for path in changed if path not in self.directories]
+        self.directories.update(changed)
+        if changed:
+            self.folders_changed.emit(list(changed))
+        if removed_dirs:
+            removed = set(removed_dirs)
+            for path in removed_dirs:
+                self.directories.pop(path, None)
+            watched = [path for path in self.watcher.directories() if path in removed]
+            if watched:
+                self.watcher.removePaths(watched)
+            self.unwatched = [path for path in self.unwatched if path not in removed]
+        if new_dirs:
+            self.add_watches(new_dirs)
+
+    def on_refresh_finished(self):
+        thread = self.sender()
+        if thread is self.refresh_thread:
+            self.refresh_thread = None
+            self.flush_pending()
+        thread.deleteLater()
+
 # Settings window (interface 1)
 class SettingsDialog(QDialog):
     settings_updated = pyqtSignal(dict)
@@ -728,6 +1431,28 @@ class SettingsDialog(QDialog):
         )
         self.timer_volume_adjuster.unlimited_checkbox.hide()  # Скрываем чекбокс бесконечности для громкости
         left_column_layout.addWidget(self.timer_volume_adjuster)
+
+        # Сканирование папок
+        scan_header = QWidget()
+        scan_header_layout = QHBoxLayout(scan_header)
+        scan_header_layout.setContentsMargins(0, 8, 0, 0)
+        scan_header_layout.setSpacing(0)
+
+        scan_label = QLabel(tr("Folder scanning"))
+        scan_label.setProperty('isHeader', True)
+        scan_label.original_text = "Folder scanning"
+        scan_header_layout.addWidget(scan_label)
+        scan_header_layout.addStretch()
+
+        left_column_layout.addWidget(scan_header)
+
+        # Сколько папок читается одновременно (больше - быстрее на сетевых дисках)
+        self.scan_workers_adjuster = ValueAdjuster(
+            tr("Scan threads:"), 1, 32, 1,
+            self.current_settings.get("scan_workers", 4)
+        )
+        self.scan_workers_adjuster.unlimited_checkbox.hide()
+        left_column_layout.addWidget(self.scan_workers_adjuster)
         
         # Добавляем растягивающийся элемент в конце левой колонки
         left_column_layout.addStretch()
@@ -815,7 +1540,8 @@ class SettingsDialog(QDialog):
             buttons_layout.setContentsMargins(0, 0, 0, 0)
             buttons_layout.setSpacing(1)  # Минимальный отступ между кнопками
             
-            for i in range(1, 4):
+            # 7 линий - сетка 8x8
+            for i in (1, 2, 3, 7):
                 btn = QPushButton(str(i))
                 btn.setCheckable(True)
                 btn.setFixedSize(40, 32)  # Увеличиваем ширину в 2,5 раза (с 16px до 40px)
@@ -883,6 +1609,11 @@ class SettingsDialog(QDialog):
         v_lines_layout.addWidget(v_lines_buttons)
         grid_content_layout.addWidget(v_lines_container)
         
+        # Диагонали кадра: вместе с сеткой 3x3 - правило третей с диагоналями
+        self.grid_diagonals_checkbox = QCheckBox(tr("Diagonals"))
+        self.grid_diagonals_checkbox.setChecked(self.current_settings.get("grid_diagonals", False))
+        grid_content_layout.addWidget(self.grid_diagonals_checkbox)
+        
         right_column_layout.addWidget(grid_content)
         
         # Добавляем растягивающийся элемент в конце правой колонки
@@ -1337,10 +2068,10 @@ class SettingsDialog(QDialog):
         if hasattr(self.parent(), 'displayed_history'):
             self.parent().displayed_history.clear()
             if self.parent().settings.get("save_history", True):
-                self.parent().config_manager.save_history(self.parent().displayed_history)
+                self.parent().config_manager.clear_history(self.parent().displayed_history)
             # Очищаем кэш изображений
-            if hasattr(self.parent(), 'pixmap_cache'):
-                self.parent().pixmap_cache.clear()
+            if hasattr(self.parent(), 'image_service'):
+                self.parent().image_service.clear()
             # Обновляем отображение количества изображений в истории
             self.update_history_count()
 
@@ -1369,8 +2100,13 @@ class SettingsDialog(QDialog):
             "language": self.language_combo.currentData(),
             "grid_h_lines": h_lines if h_lines > 0 else 2,  # Значение по умолчанию 2
             "grid_v_lines": v_lines if v_lines > 0 else 2,  # Значение по умолчанию 2
+            "grid_diagonals": self.grid_diagonals_checkbox.isChecked(),
             "timer_volume": self.timer_volume_adjuster.value(),
-            "theme": self.theme_combo.currentData()
+            "theme": self.theme_combo.currentData(),
+            "scan_workers": self.scan_workers_adjuster.value(),
+            "scan_workers_overrides": self.current_settings.get("scan_workers_overrides", {}),
+            "pixmap_cache_mb": self.current_settings.get("pixmap_cache_mb", 0),
+            "disk_cache_mb": self.current_settings.get("disk_cache_mb", 1024)
         }
         
         # Эмитим сигнал с новыми настройками
@@ -1486,6 +2222,8 @@ class SettingsDialog(QDialog):
             self.break_checkbox.setText(tr("Enable breaks"))
         if hasattr(self, 'timer_volume_adjuster'):
             self.timer_volume_adjuster.label.setText(tr("Volume:"))
+        if hasattr(self, 'scan_workers_adjuster'):
+            self.scan_workers_adjuster.label.setText(tr("Scan threads:"))
 
         # Обновляем тексты в истории
         if hasattr(self, 'history_checkbox'):
@@ -1499,6 +2237,7 @@ class SettingsDialog(QDialog):
             self.grid_settings_label.setText(tr("Grid Settings"))
             self.grid_h_lines_label.setText(tr("Horizontal lines"))
             self.grid_v_lines_label.setText(tr("Vertical lines"))
+            self.grid_diagonals_checkbox.setText(tr("Diagonals"))
 
         # Обновляем тексты в селекторе позиции таймера
         if hasattr(self, 'timer_position') and hasattr(self.timer_position, 'combo'):
@@ -1623,6 +2362,7 @@ class SettingsDialog(QDialog):
         self.num_adjuster.apply_theme()
         self.break_adjuster.apply_theme()
         self.timer_volume_adjuster.apply_theme()
+        self.scan_workers_adjuster.apply_theme()
         
         # Создаем стиль для чекбоксов
         checkbox_style = f"""
@@ -1884,78 +2624,38 @@ class SettingsDialog(QDialog):
 
     def update_folder_label(self, folder_path):
         if folder_path:
-            # Получаем абсолютный путь к папке
-            abs_folder_path = os.path.abspath(folder_path)
-            
             # Получаем количество изображений в папке
             total_images = len(self.parent().image_files) if hasattr(self.parent(), 'image_files') else 0
-            
-            # Формируем текст с информацией о папке и количестве изображений
-            folder_info = f"{tr('Current folder')}: {folder_path}"
-            images_info = f"\n{tr('Images in folder')}: {total_images}"
-            
-            self.current_folder_label.setText(folder_info + images_info)
-            self.current_folder_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+            self.update_folder_info(folder_path, total_images)
             self.folder_drop.set_folder(folder_path)
         else:
             self.current_folder_label.setText(tr("No folder selected"))
             self.current_folder_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
             self.folder_drop.clear_folder()
 
+    def update_folder_info(self, folder_path, total_images):
+        """Текст с папкой и количеством изображений в ней"""
+        folder_info = f"{tr('Current folder')}: {folder_path}"
+        images_info = f"\n{tr('Images in folder')}: {total_images}"
+        self.current_folder_label.setText(folder_info + images_info)
+        self.current_folder_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+
     def on_folder_dropped(self, folder_path):
         if os.path.isdir(folder_path):
             self.current_settings["folder"] = folder_path
             self.update_folder_label(folder_path)
             
-            # Если это режим перетащенных изображений, обновляем превью
-            if hasattr(self, 'is_dropped_images_mode') and self.is_dropped_images_mode:
-                self.load_preview_images(folder_path)
-            # Загружаем изображения для превью, но не запускаем сессию
-            if hasattr(self.parent(), 'load_images'):
-                self.parent().scanner_thread = FolderScannerThread(folder_path, self.parent().supported_extensions)
-                self.parent().scanner_thread.scanned.connect(self.on_preview_images_scanned)
-                self.parent().scanner_thread.error.connect(self.parent().on_scanner_error)
-                self.parent().scanner_thread.progress.connect(self.parent().on_progress)
-                self.parent().scanner_thread.start()
-
-    def on_preview_images_scanned(self, files):
-        if hasattr(self.parent(), 'progress_label'):
-            self.parent().progress_label.hide()
-        if files:
-            self.parent().image_files = files
-            # Логируем количество найденных изображений
-            logging.info(f"Found images: {len(files)}")
-            
-            # Если это режим перетащенных изображений, настраиваем превью
-            if hasattr(self, 'is_dropped_images_mode') and self.is_dropped_images_mode:
-                self.preview_images = files
-                if self.preview_mode_btn.isChecked():
-                    # Ограничиваем количество превью для лучшей производительности
-                    if len(self.preview_images) > 15:
-                        self.preview_images = random.sample(self.preview_images, 15)
-                    else:
-                        random.shuffle(self.preview_images)
-                    
-                    # Обновляем UI для отображения превью
-                    colors = theme_manager.get_theme_colors()
-                    self.preview_drop.setStyleSheet(f"""
-                        QLabel {{
-                            background-color: transparent;
-                            border: 2px dashed {colors['border']};
-                            border-radius: 8px;
-                            padding: 0px;
-                            color: {colors['text_secondary']};
-                        }}
-                    """)
-                    
-                    # Запускаем превью
-                    self.preview_timer.start()
-                    self.update_preview_image()
-            
-            # Обновляем информацию о количестве изображений в текущей папке
-            current_folder = self.current_settings.get("folder", "")
-            if current_folder:
-                self.update_folder_label(current_folder)
+            # Загружаем изображения для превью, но не запускаем сессию;
+            # по окончании сканирования MainWindow вызовет on_folder_scanned
+            if hasattr(self.parent(), 'start_folder_scan'):
+                self.parent().start_folder_scan(folder_path)
+
+    def on_folder_scanned(self, folder_path, total_images):
+        """Обновляет информацию о папке, когда MainWindow закончил ее сканирование"""
+        self.update_folder_info(folder_path, total_images)
+        # В режиме перетащенных изображений превью берем из результатов сканирования
+        if getattr(self, 'is_dropped_images_mode', False) and total_images:
+            self.folder_drop.show_preview_images(self.parent().image_files)
 
     def on_mode_changed(self, preview_mode):
         # Обновляем текущие настройки при изменении режима
@@ -1988,8 +2688,13 @@ class SettingsDialog(QDialog):
             "language": self.language_combo.currentData(),
             "grid_h_lines": h_lines if h_lines > 0 else 2,  # Значение по умолчанию 2
             "grid_v_lines": v_lines if v_lines > 0 else 2,  # Значение по умолчанию 2
+            "grid_diagonals": self.grid_diagonals_checkbox.isChecked(),
             "timer_volume": self.timer_volume_adjuster.value(),
-            "theme": self.theme_combo.currentData()
+            "theme": self.theme_combo.currentData(),
+            "scan_workers": self.scan_workers_adjuster.value(),
+            "scan_workers_overrides": self.current_settings.get("scan_workers_overrides", {}),
+            "pixmap_cache_mb": self.current_settings.get("pixmap_cache_mb", 0),
+            "disk_cache_mb": self.current_settings.get("disk_cache_mb", 1024)
         }
         
         # Передаем настройки в MainWindow
@@ -2132,8 +2837,11 @@ class FolderDropArea(QWidget):
         self.current_preview_index = 0
         self.current_preview_pixmap = None
         self.preview_direction = 1  # 1 = вверх, -1 = вниз
-        self.preview_cache = {}  # Кэш для превью изображений
-        self.max_preview_cache = 10  # Максимум 10 превью в кэше
+        # Превью - миниатюры из общего сервиса изображений, загрузка идет в фоне
+        self.image_service = ImageService.shared()
+        self.image_service.thumbnail_ready.connect(self.on_thumbnail_ready)
+        self.image_service.thumbnail_failed.connect(self.on_thumbnail_failed)
+        self.pending_preview_path = None
         self.dropped_images = []  # Список перетащенных изображений
         self.is_dropped_images_mode = False  # Режим работы с перетащенными изображениями
         
@@ -2602,36 +3310,41 @@ class FolderDropArea(QWidget):
         supported_extensions = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".webp")
         
         try:
+            images = []
             for root, _, files in os.walk(folder_path):
                 for file in files:
                     if file.lower().endswith(supported_extensions):
-                        self.preview_images.append(os.path.join(root, file))
-                        
-            if self.preview_images and self.preview_mode_btn.isChecked():
-                # Ограничиваем количество превью для лучшей производительности
-                if len(self.preview_images) > 15:  # Уменьшаем до 15 для лучшей производительности
-                    self.preview_images = random.sample(self.preview_images, 15)
-                else:
-                    random.shuffle(self.preview_images)
-                
-                # Обновляем UI для отображения превью
-                colors = theme_manager.get_theme_colors()
-                self.preview_drop.setStyleSheet(f"""
-                    QLabel {{
-                        background-color: transparent;
-                        border: 2px dashed {colors['border']};
-                        border-radius: 8px;
-                        padding: 0px;
-                        color: {colors['text_secondary']};
-                    }}
-                """)
-                
-                # Запускаем отображение превью
-                QTimer.singleShot(100, self.update_preview_image)
-                self.preview_timer.start()
+                        images.append(os.path.join(root, file))
+            self.show_preview_images(images)
         except Exception as e:
             logging.error(f"Error loading preview images: {e}")
 
+    def show_preview_images(self, images):
+        """Показывает превью из готового списка (list или ImageCollection)"""
+        self.current_preview_index = 0
+        # Ограничиваем количество превью для лучшей производительности
+        if len(images) > 15:
+            self.preview_images = [images[index] for index in random.sample(range(len(images)), 15)]
+        else:
+            self.preview_images = list(images)
+            random.shuffle(self.preview_images)
+        if self.preview_images and self.preview_mode_btn.isChecked():
+            # Обновляем UI для отображения превью
+            colors = theme_manager.get_theme_colors()
+            self.preview_drop.setStyleSheet(f"""
+                QLabel {{
+                    background-color: transparent;
+                    border: 2px dashed {colors['border']};
+                    border-radius: 8px;
+                    padding: 0px;
+                    color: {colors['text_secondary']};
+                }}
+            """)
+            
+            # Запускаем отображение превью
+            QTimer.singleShot(100, self.update_preview_image)
+            self.preview_timer.start()
+
     def update_preview_image(self):
         if not self.preview_images:
             return
@@ -2640,41 +3353,38 @@ class FolderDropArea(QWidget):
         self.current_preview_index = random.randint(0, len(self.preview_images) - 1)
         image_path = self.preview_images[self.current_preview_index]
         
-        try:
-            # Проверяем кэш превью
-            if image_path in self.preview_cache:
-                self.current_preview_pixmap = self.preview_cache[image_path]
-            else:
-                pixmap = QPixmap(image_path)
-                if not pixmap.isNull():
-                    # Масштабируем изображение точно по ширине виджета (оптимизированное масштабирование)
-                    target_width = self.preview_drop.width()
-                    if pixmap.width() > target_width:
-                        scaled_pixmap = pixmap.scaledToWidth(
-                            target_width,
-                            Qt.TransformationMode.SmoothTransformation
-                        )
-                    else:
-                        scaled_pixmap = pixmap  # Используем оригинал если он меньше
-                    
-                    # Кэшируем превью
-                    if len(self.preview_cache) >= self.max_preview_cache:
-                        # Удаляем самый старый элемент
-                        oldest_key = next(iter(self.preview_cache))
-                        del self.preview_cache[oldest_key]
-                    self.preview_cache[image_path] = scaled_pixmap
-                    self.current_preview_pixmap = scaled_pixmap
-                
-                self.preview_offset = 0
-                self.preview_direction *= -1  # Меняем направление анимации
-                self.update_preview()  # Сразу обновляем превью
-                self.start_preview_animation()
-        except Exception as e:
-            logging.error(f"Error loading preview: {e}")
-            # Пробуем следующее изображение при ошибке
-            self.preview_images.remove(image_path) if image_path in self.preview_images else None
-            if self.preview_images:
-                QTimer.singleShot(100, self.update_preview_image)
+        # Миниатюра из памяти показывается сразу, иначе ждем ее из фонового потока
+        self.pending_preview_path = image_path
+        thumbnail = self.image_service.thumbnail(image_path, self.preview_drop.width())
+        if thumbnail is not None:
+            self.show_preview_thumbnail(image_path, thumbnail)
+
+    def on_thumbnail_ready(self, image_path, pixmap):
+        if image_path == self.pending_preview_path:
+            self.show_preview_thumbnail(image_path, pixmap)
+
+    def on_thumbnail_failed(self, image_path):
+        if image_path != self.pending_preview_path:
+            return
+        self.pending_preview_path = None
+        logging.error(f"Error loading preview: {image_path}")
+        # Пробуем следующее изображение при ошибке
+        self.preview_images.remove(image_path) if image_path in self.preview_images else None
+        if self.preview_images:
+            QTimer.singleShot(100, self.update_preview_image)
+
+    def show_preview_thumbnail(self, image_path, pixmap):
+        self.pending_preview_path = None
+        # Масштабируем изображение точно по ширине виджета
+        target_width = self.preview_drop.width()
+        if pixmap.width() > target_width:
+            pixmap = pixmap.scaledToWidth(target_width, Qt.TransformationMode.SmoothTransformation)
+        self.current_preview_pixmap = pixmap
+        
+        self.preview_offset = 0
+        self.preview_direction *= -1  # Меняем направление анимации
+        self.update_preview()  # Сразу обновляем превью
+        self.start_preview_animation()
 
     def start_preview_animation(self):
         if not self.current_preview_pixmap:
@@ -3168,6 +3878,1419 @@ class TimerPositionSelector(QWidget):
     def currentPosition(self):
         return self.combo.currentData()
 
+# Общее хранилище путей: каждая папка хранится один раз, файлы получают целочисленные id
+class PathStore:
+    """Interns image paths behind dense integer ids.
+
+    A path is kept as its directory id plus the file name. Directory
+    prefixes are stored once and all file names live encoded in one bytes
+    buffer with an offsets array, so a path costs its name bytes and a few
+    array slots rather than a str object and dict entries. Every directory
+    keeps its ids in arrays sorted by name hash, searched with a binary
+    search that runs entirely in C, plus a small dict of recently added
+    names that is merged into the arrays as it grows. Ids are never
+    reused; collections keep ids and turn them back into paths only when a
+    path is actually needed.
+    """
+    MERGE_MIN = 64  # Меньше стольких новых имен в папке сливать не стоит
+
+    def __init__(self):
+        self.dirs = []                        # dir id -> путь папки
+        self.dir_ids = {}                     # путь папки -> dir id
+        self.dir_hashes = []                  # dir id -> array хэшей имен по возрастанию
+        self.dir_sorted = []                  # dir id -> array path id в том же порядке
+        self.dir_recent = []                  # dir id -> {имя в байтах: path id}, еще не слитые
+        self.path_dirs = array('i')           # path id -> dir id
+        self.name_bytes = bytearray()         # Имена файлов подряд, в кодировке файловой системы
+        self.name_offsets = array('q', [0])   # path id -> начало имени; последний элемент - конец буфера
+
+    def __len__(self):
+        return len(self.path_dirs)
+
+    def name_key(self, path_id):
+        return self.name_bytes[self.name_offsets[path_id]:self.name_offsets[path_id + 1]]
+
+    def find(self, dir_id, name):
+        """Returns the id of an encoded file name in a directory or None"""
+        path_id = self.dir_recent[dir_id].get(name)
+        if path_id is not None:
+            return path_id
+        hashes = self.dir_hashes[dir_id]
+        name_hash = hash(name)
+        index = bisect_left(hashes, name_hash)
+        ids = self.dir_sorted[dir_id]
+        # Одинаковый хэш у разных имен редок, но возможен
+        while index < len(hashes) and hashes[index] == name_hash:
+            if self.name_key(ids[index]) == name:
+                return ids[index]
+            index += 1
+        return None
+
+    def merge(self, dir_id):
+        """Folds the recently added names of a directory into its sorted array"""
+        entries = list(zip(self.dir_hashes[dir_id], self.dir_sorted[dir_id]))
+        entries.extend((hash(name), path_id) for name, path_id in self.dir_recent[dir_id].items())
+        entries.sort()
+        self.dir_hashes[dir_id] = array('q', [name_hash for name_hash, _ in entries])
+        self.dir_sorted[dir_id] = array('i', [path_id for _, path_id in entries])
+        self.dir_recent[dir_id] = {}
+
+    def intern(self, path):
+        """Returns the id of a path, adding it if needed"""
+        folder, name = os.path.split(path)
+        name = os.fsencode(name)
+        dir_id = self.dir_ids.get(folder)
+        if dir_id is None:
+            dir_id = len(self.dirs)
+            self.dirs.append(folder)
+            self.dir_ids[folder] = dir_id
+            self.dir_hashes.append(array('q'))
+            self.dir_sorted.append(array('i'))
+            self.dir_recent.append({})
+        path_id = self.find(dir_id, name)
+        if path_id is None:
+            path_id = len(self.path_dirs)
+            self.path_dirs.append(dir_id)
+            self.name_bytes += name
+            self.name_offsets.append(len(self.name_bytes))
+            recent = self.dir_recent[dir_id]
+            recent[name] = path_id
+            if len(recent) > max(self.MERGE_MIN, len(self.dir_sorted[dir_id]) // 8):
+                self.merge(dir_id)
+        return path_id
+
+    def lookup(self, path):
+        """Returns the id of a known path or None"""
+        folder, name = os.path.split(path)
+        dir_id = self.dir_ids.get(folder)
+        if dir_id is None:
+            return None
+        return self.find(dir_id, os.fsencode(name))
+
+    def path(self, path_id):
+        name = os.fsdecode(bytes(self.name_key(path_id)))
+        return os.path.join(self.dirs[self.path_dirs[path_id]], name)
+
+path_store = PathStore()
+
+# Список путей с быстрым поиском и удалением
+class ImageCollection:
+    """List of unique image paths stored as an array of PathStore ids.
+
+    Every id is mapped to its slot, so membership, index() and removal are
+    O(1) without a set of strings. Small collections keep that map in a
+    dict; once a collection covers a noticeable share of the store it
+    switches to an array indexed by id (-1 when absent), which is then
+    cheaper than dict entries. Unordered collections fill the hole left by a removed path
+    with the last one; ordered collections leave a tombstone and compact
+    when tombstones pile up or before positional access. Paths are only
+    built when the collection is read.
+    """
+    # Массив позиций выгоднее словаря, когда в коллекции больше 1/DENSE_RATIO хранилища
+    DENSE_RATIO = 8
+
+    def __init__(self, paths=(), ordered=True, store=None):
+        self.store = store if store is not None else path_store
+        self.ordered = ordered
+        self.items = array('i')  # id; -1 на месте удаленного
+        self.slots = {}          # id -> позиция в items; у больших коллекций array('i') с -1 для отсутствующих
+        self.count = 0
+        self.tombstones = 0
+        self.extend(paths)
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __contains__(self, path):
+        path_id = self.store.lookup(path)
+        return path_id is not None and self.contains_id(path_id)
+
+    def contains_id(self, path_id):
+        slots = self.slots
+        if type(slots) is dict:
+            return path_id in slots
+        return path_id < len(slots) and slots[path_id] >= 0
+
+    def ids(self):
+        return (path_id for path_id in self.items if path_id >= 0)
+
+    def __iter__(self):
+        path = self.store.path
+        return (path(path_id) for path_id in self.items if path_id >= 0)
+
+    def __getitem__(self, index):
+        self.compact()
+        if isinstance(index, slice):
+            return [self.store.path(path_id) for path_id in self.items[index]]
+        return self.store.path(self.items[index])
+
+    def append(self, path):
+        """Adds a path to the end; paths already in the collection are ignored"""
+        self.append_id(self.store.intern(path))
+
+    def append_id(self, path_id):
+        if self.contains_id(path_id):
+            return
+        slots = self.slots
+        if type(slots) is dict:
+            slots[path_id] = len(self.items)
+            if len(slots) * self.DENSE_RATIO > len(self.store):
+                self.make_dense_slots()
+        else:
+            if path_id >= len(slots):
+                # Растим с запасом, чтобы добавление оставалось O(1) в среднем
+                grow = max(path_id + 1 - len(slots), len(slots) // 2, 1024)
+                slots.extend(array('i', [-1]) * grow)
+            slots[path_id] = len(self.items)
+        self.items.append(path_id)
+        self.count += 1
+
+    def make_dense_slots(self):
+        """Replaces the slot dict with an array indexed by id"""
+        slots = array('i', [-1]) * len(self.store)
+        for path_id, slot in self.slots.items():
+            slots[path_id] = slot
+        self.slots = slots
+
+    def extend(self, paths):
+        for path in paths:
+            self.append(path)
+
+    def discard(self, path):
+        """Removes a path if present, returns whether it was there"""
+        path_id = self.store.lookup(path)
+        return path_id is not None and self.discard_id(path_id)
+
+    def discard_id(self, path_id):
+        if not self.contains_id(path_id):
+            return False
+        slot = self.slots[path_id]
+        if type(self.slots) is dict:
+            del self.slots[path_id]
+        else:
+            self.slots[path_id] = -1
+        self.count -= 1
+        if self.ordered:
+            self.items[slot] = -1
+            self.tombstones += 1
+            if self.tombstones * 2 > len(self.items):
+                self.compact()
+        else:
+            last = self.items.pop()
+            if slot < len(self.items):
+                self.items[slot] = last
+                self.slots[last] = slot
+        return True
+
+    def discard_many(self, paths):
+        for path in paths:
+            self.discard(path)
+
+    def remove(self, path):
+        if not self.discard(path):
+            raise ValueError(f"{path} is not in collection")
+
+    def index(self, path):
+        self.compact()
+        path_id = self.store.lookup(path)
+        if path_id is None or not self.contains_id(path_id):
+            raise ValueError(f"{path} is not in collection")
+        return self.slots[path_id]
+
+    def pop(self, index=-1):
+        self.compact()
+        path_id = self.items[index]
+        self.discard_id(path_id)
+        return self.store.path(path_id)
+
+    def clear(self):
+        self.items = array('i')
+        self.slots = {}
+        self.count = 0
+        self.tombstones = 0
+
+    def copy(self):
+        self.compact()
+        collection = ImageCollection(ordered=self.ordered, store=self.store)
+        collection.items = array('i', self.items)
+        if type(self.slots) is not dict and self.count * self.DENSE_RATIO > len(self.store):
+            collection.slots = array('i', self.slots)
+        else:
+            # Коллекция могла заметно уменьшиться - копии хватит словаря
+            collection.slots = {path_id: slot for slot, path_id in enumerate(self.items)}
+        collection.count = self.count
+        return collection
+
+    def compact(self):
+        if not self.tombstones:
+            return
+        self.items = array('i', self.ids())
+        for slot, path_id in enumerate(self.items):
+            self.slots[path_id] = slot
+        self.tombstones = 0
+
+# Случайный выбор изображений без повторов
+class ImageSampler:
+    """Picks the next image in random order without scanning the whole library.
+
+    Keeps a shuffled deck of path ids that is consumed one Fisher-Yates
+    step at a time. Images that left the library or got into the history
+    stay in the deck and are skipped lazily, using the O(1) id membership
+    of both collections, so every draw is O(1) amortized and only the
+    drawn path is materialized.
+    """
+
+    def __init__(self, library, history):
+        self.library = library  # ImageCollection всех изображений
+        self.history = history  # ImageCollection просмотренных изображений
+        self.deck = array('i')
+        self.position = 0       # Все, что левее, уже вытянуто в этом проходе
+
+    def reset(self):
+        self.deck = array('i')
+        self.position = 0
+
+    def add(self, files):
+        """New images go to the untouched part of the deck"""
+        intern = self.library.store.intern
+        self.deck.extend(intern(path) for path in files)
+
+    def draw(self, skip_seen=True, exclude=None):
+        """Returns a random image or None when nothing is left to show.
+
+        With skip_seen only images outside the history are returned, so None
+        means that everything has been viewed.
+        """
+        exclude_id = self.library.store.lookup(exclude) if exclude else None
+        library = self.library
+        history = self.history
+        refilled = False
+        while True:
+            deck = self.deck
+            while self.position < len(deck):
+                index = random.randrange(self.position, len(deck))
+                deck[self.position], deck[index] = deck[index], deck[self.position]
+                candidate = deck[self.position]
+                self.position += 1
+                if candidate == exclude_id or not library.contains_id(candidate):
+                    continue
+                if skip_seen and history.contains_id(candidate):
+                    continue
+                return library.store.path(candidate)
+            # Колода закончилась - собираем новую из того, что еще можно показать
+            if refilled:
+                return None
+            self.deck = array('i', (path_id for path_id in library.ids()
+                                    if not (skip_seen and history.contains_id(path_id))))
+            self.position = 0
+            refilled = True
+
+# Кэш декодированных изображений с ограничением по памяти
+class PixmapCache:
+    """LRU cache of decoded pixmaps limited by bytes rather than entries.
+
+    Keys are (path, variant), so thumbnails, screen-sized decodes and
+    full-resolution ones are kept apart under one budget. Lookups never
+    touch the file system: on network folders a stat per hit would put
+    file-system latency on every navigation. Entries of files that were
+    replaced, renamed or deleted are dropped through invalidate() and
+    invalidate_folders(), driven by the FolderWatcher. Hits, misses and
+    evictions are counted for the log.
+    """
+    VARIANT_THUMBNAIL = "thumbnail"
+    VARIANT_SCREEN = "screen"
+    VARIANT_FULL = "full"
+    # Для показа годится полная версия или экранная, полная предпочтительнее
+    DISPLAY_VARIANTS = (VARIANT_FULL, VARIANT_SCREEN)
+
+    MIN_BUDGET = 128 * 1024 * 1024
+    MAX_BUDGET = 2 * 1024 * 1024 * 1024
+
+    def __init__(self, budget=None):
+        self.budget = budget or self.default_budget()
+        self.entries = OrderedDict()  # key -> (pixmap, байты)
+        self.keys_by_path = {}        # путь -> ключи всех его вариантов
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def default_budget(cls):
+        """An eighth of the available memory, within 128 MB - 2 GB"""
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        available = int(line.split()[1]) * 1024
+                        return max(cls.MIN_BUDGET, min(cls.MAX_BUDGET, available // 8))
+        except (OSError, ValueError):
+            pass
+        return 512 * 1024 * 1024
+
+    @staticmethod
+    def pixmap_bytes(pixmap):
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+    def lookup(self, path, variants=DISPLAY_VARIANTS):
+        """Returns (pixmap, variant) for the first of `variants` that is cached, or None"""
+        for variant in variants:
+            key = (path, variant)
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], variant
+        self.misses += 1
+        return None
+
+    def contains(self, path, variants=DISPLAY_VARIANTS):
+        """Checks for an entry without touching LRU order or hit counters"""
+        return any((path, variant) in self.entries for variant in variants)
+
+    def put(self, path, pixmap, variant=VARIANT_SCREEN):
+        if pixmap is None or pixmap.isNull():
+            return
+        size = self.pixmap_bytes(pixmap)
+        if size > self.budget:
+            return
+        if variant == self.VARIANT_FULL:
+            # Полная версия заменяет экранную
+            self.remove_key((path, self.VARIANT_SCREEN))
+        key = (path, variant)
+        self.remove_key(key)
+        self.entries[key] = (pixmap, size)
+        self.keys_by_path.setdefault(path, set()).add(key)
+        self.used += size
+        while self.used > self.budget and self.entries:
+            oldest = next(iter(self.entries))
+            self.remove_key(oldest)
+            self.evictions += 1
+
+    def remove_key(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.used -= entry[1]
+        keys = self.keys_by_path.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_path[key[0]]
+
+    def invalidate(self, path):
+        """Drops every cached variant of a file"""
+        for key in list(self.keys_by_path.get(path, ())):
+            self.remove_key(key)
+
+    def invalidate_many(self, paths):
+        for path in paths:
+            self.invalidate(path)
+
+    def cached_paths(self, folders):
+        """Paths with cached entries that lie directly in one of `folders`"""
+        folders = set(folders)
+        return [path for path in self.keys_by_path if os.path.dirname(path) in folders]
+
+    def clear(self):
+        self.entries.clear()
+        self.keys_by_path.clear()
+        self.used = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return (f"{len(self.entries)} images, {self.used // (1024 * 1024)} of "
+                f"{self.budget // (1024 * 1024)} MB, hits: {self.hits}, misses: {self.misses}, "
+                f"evictions: {self.evictions}")
+
+# Дисковый кэш изображений, уже уменьшенных до размера экрана
+class DiskImageCache:
+    """Persistent LRU cache of screen-sized decodes under ~/.gestart/cache.
+
+    HEIC, big PNG and 16-bit TIFF files take far longer to decode than a
+    screen-sized JPEG of the same picture, so decodes slower than
+    MIN_DECODE_TIME are stored as JPEG (PNG when the image has alpha),
+    keyed by a hash of path, mtime and size. The source size is kept in
+    the image text so a cached copy is known to be big enough for the
+    requested size. Only downscaled decodes are stored: a lossy copy at the
+    full size would pass for the original when zooming or copying. Lookups
+    run on decode workers; writes and eviction run on a separate
+    background thread. The file mtime serves as the LRU stamp.
+    """
+    MIN_DECODE_TIME = 0.05
+    SOURCE_SIZE_KEY = "GestArt-Source-Size"
+
+    def __init__(self, cache_dir, budget):
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.entries = None  # имя файла -> байты; читается при первом обращении
+        self.used = 0
+        self.queue = deque()  # (путь, mtime_ns, размер, QImage, исходный размер) на запись
+        self.running = True
+        self.thread = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def ensure_index(self):
+        # Вызывается под self.lock
+        if self.entries is not None:
+            return
+        self.entries = {}
+        self.used = 0
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.name.endswith(".tmp"):
+                        # Запись, прерванная закрытием программы
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+                    elif entry.is_file():
+                        size = entry.stat().st_size
+                        self.entries[entry.name] = size
+                        self.used += size
+        except OSError as e:
+            logging.error(f"Error reading image cache {self.cache_dir}: {e}")
+
+    @staticmethod
+    def entry_key(path, mtime_ns, size):
+        return hashlib.sha1(f"{path}\0{mtime_ns}\0{size}".encode("utf-8", "surrogateescape")).hexdigest()
+
+    @staticmethod
+    def stat_key(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return path, stat.st_mtime_ns, stat.st_size
+
+    def lookup(self, path, target_size):
+        """Returns (QImage, source size) for a cached copy good enough for target_size, or None"""
+        file_key = self.stat_key(path)
+        if file_key is None:
+            return None
+        key = self.entry_key(*file_key)
+        with self.lock:
+            self.ensure_index()
+            name = next((key + ext for ext in (".jpg", ".png") if key + ext in self.entries), None)
+            if name is None:
+                self.misses += 1
+                return None
+        cache_path = os.path.join(self.cache_dir, name)
+        reader = QImageReader(cache_path)
+        cached_size = reader.size()
+        source_size = QSize(*map(int, reader.text(self.SOURCE_SIZE_KEY).split("x"))) \
+            if reader.text(self.SOURCE_SIZE_KEY) else QSize()
+        # Годится только уменьшенная копия не меньше нужного размера. Копия во весь исходный
+        # размер (из прежних версий) сжата с потерями и сошла бы за оригинал при зуме
+        expected = source_size.scaled(target_size, Qt.AspectRatioMode.KeepAspectRatio) \
+            if source_size.isValid() else QSize()
+        if (not cached_size.isValid() or not source_size.isValid() or
+                (cached_size.width() >= source_size.width() and cached_size.height() >= source_size.height()) or
+                (cached_size.width() < expected.width() and cached_size.height() < expected.height())):
+            with self.lock:
+                self.misses += 1
+            return None
+        image = reader.read()
+        if image.isNull():
+            self.remove(name)
+            with self.lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(cache_path)  # Отметка для LRU
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+        return image, source_size
+
+    def store(self, path, image, source_size):
+        """Queues a decoded image for writing in the background"""
+        file_key = self.stat_key(path)
+        if file_key is None or image.isNull() or not source_size.isValid():
+            return
+        with self.condition:
+            if not self.running:
+                return
+            self.queue.append(file_key + (image, source_size))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="gestart-image-cache", daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                path, mtime_ns, size, image, source_size = self.queue.popleft()
+                self.ensure_index()
+            self.write(path, mtime_ns, size, image, source_size)
+
+    def write(self, path, mtime_ns, size, image, source_size):
+        image = image.copy()  # Текст добавляем к своей копии, а не к показанному изображению
+        image.setText(self.SOURCE_SIZE_KEY, f"{source_size.width()}x{source_size.height()}")
+        if image.hasAlphaChannel():
+            name, image_format, quality = self.entry_key(path, mtime_ns, size) + ".png", "PNG", 90
+        else:
+            name, image_format, quality = self.entry_key(path, mtime_ns, size) + ".jpg", "JPEG", 92
+        cache_path = os.path.join(self.cache_dir, name)
+        try:
+            if not image.save(cache_path + ".tmp", image_format, quality):
+                raise OSError("image writer failed")
+            os.replace(cache_path + ".tmp", cache_path)
+            written = os.path.getsize(cache_path)
+        except OSError as e:
+            logging.warning(f"Error caching {path}: {e}")
+            return
+        with self.lock:
+            self.used += written - self.entries.get(name, 0)
+            self.entries[name] = written
+            self.writes += 1
+        if self.used > self.budget:
+            self.evict()
+
+    def evict(self):
+        """Removes the least recently used files until the cache is at 90% of its budget"""
+        with self.lock:
+            names = list(self.entries)
+        stamps = []
+        for name in names:
+            try:
+                stamps.append((os.stat(os.path.join(self.cache_dir, name)).st_mtime_ns, name))
+            except OSError:
+                stamps.append((0, name))
+        stamps.sort()
+        for _, name in stamps:
+            if self.used <= self.budget * 0.9:
+                break
+            self.remove(name)
+            self.evictions += 1
+
+    def remove(self, name):
+        try:
+            os.remove(os.path.join(self.cache_dir, name))
+        except OSError:
+            pass
+        with self.lock:
+            self.used -= self.entries.pop(name, 0)
+
+    def clear(self):
+        with self.lock:
+            self.queue.clear()
+            self.ensure_index()
+            names = list(self.entries)
+        for name in names:
+            self.remove(name)
+
+    def stop(self):
+        """Stops the writer; unwritten images are dropped, they are only a cache"""
+        with self.condition:
+            self.running = False
+            self.queue.clear()
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(5)
+
+    def stats(self):
+        with self.lock:
+            count = len(self.entries) if self.entries is not None else 0
+        return (f"{count} images, {self.used // (1024 * 1024)} of {self.budget // (1024 * 1024)} MB, "
+                f"hits: {self.hits}, misses: {self.misses}, writes: {self.writes}, evictions: {self.evictions}")
+
+# Миниатюра одного файла по спецификации freedesktop, в потоке пула
+class ThumbnailTask(QRunnable):
+    """Finds or creates the thumbnail of one image on a ThumbnailCache worker"""
+
+    def __init__(self, cache, image_path, width):
+        super().__init__()
+        self.cache = cache
+        self.image_path = image_path
+        self.width = width
+
+    def run(self):
+        try:
+            image = self.cache.load_thumbnail(self.image_path, self.width)
+        except Exception as e:
+            logging.error(f"Error creating thumbnail for {self.image_path}: {e}")
+            image = None
+        if image is None or image.isNull():
+            self.cache.failed.emit(self.image_path)
+        else:
+            self.cache.ready.emit(self.image_path, image)
+
+# Дисковый кэш миниатюр; в памяти миниатюры держит ImageService
+class ThumbnailCache(QObject):
+    """Thumbnail cache compatible with the freedesktop thumbnail spec.
+
+    Thumbnails live in $XDG_CACHE_HOME/thumbnails/<size>/<md5 of file URI>.png
+    and carry Thumb::URI and Thumb::MTime, so thumbnails made by the file
+    manager are reused and ours are reused by it. A thumbnail fits a square
+    of the size class (128, 256, 512 or 1024); the smallest class that gives
+    the requested width is used. Lookups and generation run on a small
+    thread pool and results arrive through `ready`; a thumbnail that holds
+    the whole picture is marked with the Thumb::Full text.
+    """
+    SIZES = (("normal", 128), ("large", 256), ("x-large", 512), ("xx-large", 1024))
+
+    ready = pyqtSignal(str, QImage)  # путь к изображению, миниатюра
+    failed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        self.root = os.path.join(cache_home, "thumbnails")
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self.pending = set()
+        self.ready.connect(self.on_ready)
+        self.failed.connect(self.on_failed)
+
+    @staticmethod
+    def file_uri(path):
+        # Те же неэкранируемые символы, что и у g_filename_to_uri, иначе имена не совпадут
+        return "file://" + quote(os.path.abspath(path), safe="/!$&'()*+,;=:@~")
+
+    def request(self, image_path, width):
+        """Starts loading a thumbnail unless it is already on its way"""
+        if image_path in self.pending:
+            return
+        self.pending.add(image_path)
+        self.pool.start(ThumbnailTask(self, image_path, width))
+
+    def on_ready(self, image_path, image):
+        self.pending.discard(image_path)
+
+    def on_failed(self, image_path):
+        self.pending.discard(image_path)
+
+    def load_thumbnail(self, image_path, width):
+        """Worker side: reads a valid thumbnail from disk or creates one"""
+        stat = os.stat(image_path)
+        uri = self.file_uri(image_path)
+        name = hashlib.md5(uri.encode("utf-8", "surrogateescape")).hexdigest() + ".png"
+        
+        for folder, size in self.SIZES:
+            reader = QImageReader(os.path.join(self.root, folder, name))
+            if not reader.canRead():
+                continue
+            # Миниатюра устарела, если файл изменился после ее создания
+            if reader.text("Thumb::URI") != uri or reader.text("Thumb::MTime") != str(int(stat.st_mtime)):
+                continue
+            thumb_size = reader.size()
+            source_width = reader.text("Thumb::Image::Width")
+            is_full = source_width.isdigit() and int(source_width) == thumb_size.width()
+            if thumb_size.width() >= width or is_full:
+                image = reader.read()
+                if not image.isNull():
+                    image.setText("Thumb::Full", "1" if is_full else "0")
+                    return image
+        
+        reader = QImageReader(image_path)
+        source_size = reader.size()
+        if not source_size.isValid():
+            image = reader.read()  # Формат без размера в заголовке
+            if image.isNull():
+                return None
+            source_size = image.size()
+            reader = None
+        # Наименьший класс, при котором ширина миниатюры не меньше нужной
+        needed = math.ceil(width * max(1.0, source_size.height() / max(1, source_size.width())))
+        folder, size = next(((f, s) for f, s in self.SIZES if s >= needed), self.SIZES[-1])
+        box = QSize(size, size)
+        if reader is not None:
+            if source_size.width() > size or source_size.height() > size:
+                reader.setScaledSize(source_size.scaled(box, Qt.AspectRatioMode.KeepAspectRatio))
+            image = reader.read()
+            if image.isNull():
+                return None
+        elif source_size.width() > size or source_size.height() > size:
+            image = image.scaled(box, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+        
+        image.setText("Thumb::URI", uri)
+        image.setText("Thumb::MTime", str(int(stat.st_mtime)))
+        image.setText("Thumb::Size", str(stat.st_size))
+        image.setText("Thumb::Image::Width", str(source_size.width()))
+        image.setText("Thumb::Image::Height", str(source_size.height()))
+        image.setText("Software", "GestArt")
+        self.write_thumbnail(os.path.join(self.root, folder, name), image)
+        image.setText("Thumb::Full", "1" if image.size() == source_size else "0")
+        return image
+
+    def write_thumbnail(self, thumb_path, image):
+        # По спецификации: каталоги 0700, файлы 0600, запись через временный файл
+        temp_path = f"{thumb_path}.gestart-{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(thumb_path), mode=0o700, exist_ok=True)
+            if not image.save(temp_path, "PNG"):
+                raise OSError("image writer failed")
+            os.chmod(temp_path, 0o600)
+            os.replace(temp_path, thumb_path)
+        except OSError as e:
+            logging.warning(f"Error writing thumbnail {thumb_path}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def shutdown(self, timeout=2000):
+        self.pool.clear()
+        self.pool.waitForDone(timeout)
+
+# Тональные кривые для этюдов на валёры
+VALUE_LEVELS_BLACK = 40   # Все, что темнее, становится черным при усилении контраста
+VALUE_LEVELS_WHITE = 215  # Все, что светлее, - белым
+# Режимы кнопки этюда по кругу: (число тонов, усиление контраста, название)
+VALUE_STUDY_MODES = (
+    (0, False, "Off"),
+    (2, False, "Notan (2 values)"),
+    (3, False, "3 values"),
+    (5, False, "5 values"),
+    (0, True, "Levels"),
+)
+
+def value_study_lut(values=0, levels=False):
+    """256-entry tone curve for a grayscale image.
+
+    levels stretches VALUE_LEVELS_BLACK..VALUE_LEVELS_WHITE to full black and
+    white; values > 1 then posterizes to that many evenly spaced tones, each
+    taking an equal share of the input range (values=2 is a notan)."""
+    lut = list(range(256))
+    if levels:
+        span = VALUE_LEVELS_WHITE - VALUE_LEVELS_BLACK
+        lut = [min(255, max(0, round((v - VALUE_LEVELS_BLACK) * 255 / span))) for v in lut]
+    if values > 1:
+        lut = [round(min(values - 1, v * values // 256) * 255 / (values - 1)) for v in lut]
+    return lut
+
+def remap_grayscale(image, lut):
+    """Applies a tone curve to a Grayscale8 image without a per-pixel loop in Python:
+    the same buffer is viewed as Indexed8 with the curve as its colour table and
+    Qt's converter does the lookup. Safe to call from worker threads"""
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    indexed = QImage(bits, image.width(), image.height(), image.bytesPerLine(), QImage.Format.Format_Indexed8)
+    indexed.setColorTable([0xFF000000 | value * 0x010101 for value in lut])
+    # Результат - новое изображение, буфер исходного больше не нужен
+    return indexed.convertToFormat(QImage.Format.Format_Grayscale8)
+
+def run_color_effects(image, effects):
+    """Runs [(key, QImage -> QImage)] over the image in order"""
+    for _, effect in effects:
+        image = effect(image)
+    return image
+
+# Цветовые эффекты полноразмерного изображения в фоновом потоке
+class ColorEffectsTask(QRunnable):
+    """Applies colour effects to a full-size image and reports every intermediate stage,
+    so that a later change of the last effect can start from the cached previous one"""
+
+    def __init__(self, canvas, key, image, effects, done_keys=()):
+        super().__init__()
+        self.canvas = canvas
+        self.key = key              # (cacheKey исходного pixmap, ключи всех эффектов)
+        self.image = image          # Результат эффектов done_keys
+        self.effects = effects      # Оставшиеся эффекты
+        self.done_keys = tuple(done_keys)
+        self.cancelled = False
+
+    def run(self):
+        stages = []
+        image = self.image
+        keys = self.done_keys
+        for effect_key, effect in self.effects:
+            if self.cancelled:
+                return
+            image = effect(image)
+            keys += (effect_key,)
+            stages.append((keys, image))
+        if not self.cancelled:
+            self.canvas.effects_applied.emit(self.key, stages)
+
+# Пирамида уменьшенных копий большого изображения, разбитых на плитки
+class ImagePyramid:
+    """Mip levels of a large image, each cut into tiles.
+
+    Level i is the source halved i + 1 times (the source itself serves as
+    level 0 and is not duplicated). Tiles are turned into pixmaps only when
+    first drawn, so no level is converted on the GUI thread at once; each
+    tile carries a TILE_PADDING border of neighbouring pixels so smooth
+    filtering leaves no seams between tiles.
+    """
+    TILE_SIZE = 512
+    TILE_PADDING = 1
+
+    def __init__(self, key, width, height, levels):
+        self.key = key        # cacheKey исходного pixmap
+        self.width = width
+        self.height = height
+        self.levels = levels  # QImage, каждый следующий вдвое меньше
+        self.tiles = {}       # (уровень, столбец, строка) -> (QPixmap, смещение плитки)
+
+    def level_for_scale(self, scale):
+        """Index of the smallest level that still has at least `scale` pixels per source
+        pixel, or None when the source itself should be drawn"""
+        chosen = None
+        for index, level in enumerate(self.levels):
+            if level.width() / self.width >= scale:
+                chosen = index
+            else:
+                break
+        return chosen
+
+    def tile(self, index, column, row):
+        key = (index, column, row)
+        tile = self.tiles.get(key)
+        if tile is None:
+            level = self.levels[index]
+            rect = QRect(column * self.TILE_SIZE, row * self.TILE_SIZE, self.TILE_SIZE, self.TILE_SIZE)
+            padded = rect.adjusted(-self.TILE_PADDING, -self.TILE_PADDING,
+                                   self.TILE_PADDING, self.TILE_PADDING).intersected(level.rect())
+            tile = self.tiles[key] = (QPixmap.fromImage(level.copy(padded)), padded.topLeft())
+        return tile
+
+    def draw(self, painter, index, target_rect, source_rect):
+        """Draws source_rect (in source pixels) of level `index` into target_rect, visible tiles only"""
+        level = self.levels[index]
+        factor_x = level.width() / self.width
+        factor_y = level.height() / self.height
+        source = QRectF(source_rect.x() * factor_x, source_rect.y() * factor_y,
+                        source_rect.width() * factor_x, source_rect.height() * factor_y)
+        if source.isEmpty():
+            return
+        scale_x = target_rect.width() / source.width()
+        scale_y = target_rect.height() / source.height()
+        size = self.TILE_SIZE
+        first_column = max(0, int(source.left() // size))
+        last_column = min((level.width() - 1) // size, int(source.right() // size))
+        first_row = max(0, int(source.top() // size))
+        last_row = min((level.height() - 1) // size, int(source.bottom() // size))
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                tile_rect = QRectF(column * size, row * size, size, size).intersected(source)
+                if tile_rect.isEmpty():
+                    continue
+                pixmap, origin = self.tile(index, column, row)
+                target = QRectF(target_rect.x() + (tile_rect.x() - source.x()) * scale_x,
+                                target_rect.y() + (tile_rect.y() - source.y()) * scale_y,
+                                tile_rect.width() * scale_x, tile_rect.height() * scale_y)
+                painter.drawPixmap(target, pixmap, tile_rect.translated(-origin.x(), -origin.y()))
+
+# Построение пирамиды (и цепочки уменьшенных копий для прищура) в фоновом потоке
+class PyramidBuildTask(QRunnable):
+    """Halves the image until it is no larger than min_side and reports the levels
+    through `signal` as (key, [QImage])"""
+
+    def __init__(self, signal, key, image, min_side):
+        super().__init__()
+        self.signal = signal
+        self.key = key
+        self.image = image
+        self.min_side = min_side
+        self.cancelled = False
+
+    def run(self):
+        levels = []
+        level = self.image
+        while max(level.width(), level.height()) > self.min_side and not self.cancelled:
+            level = level.scaled(max(1, level.width() // 2), max(1, level.height() // 2),
+                                 Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            levels.append(level)
+        if not self.cancelled:
+            self.signal.emit(self.key, levels)
+
+# Область показа изображения: рисует сразу в paintEvent, без промежуточного QPixmap размером с окно
+class ImageCanvas(QWidget):
+    """Widget that paints the current image straight to the backing store.
+
+    The window hands over the decoded pixmap with the source and target
+    rectangles computed from zoom and pan, plus the size of the whole image
+    fitted to the view. Rectangles are in display coordinates, i.e. after
+    the orientation transform (flips and 90-degree rotations), which the
+    canvas applies as part of the paint transform instead of copying the
+    image. Colour effects are a list of (key, QImage -> QImage) functions:
+    the fitted copy is filtered at view size through the `color_filter`
+    callback, and the filtered full-size image is built by a
+    ColorEffectsTask only for zoomed views, drawing from the fitted copy
+    until it is ready. Intermediate stages are kept for the current image,
+    so changing only the last effect (e.g. the number of values) reruns
+    just that step. The canvas keeps the fitted copy in
+    device pixels, so zoom 1 paints it pixel for pixel and repeated updates
+    at the same size do not rescale. A change repaints only the area
+    covered by the old and the new image. The overlay (the grid) is drawn
+    by a callback into a cached transparent layer the size of the canvas,
+    which is only redrawn when the canvas size or the overlay state
+    changes; paint events composite just the damaged part of it.
+
+    Zoomed views of an image much larger than the view are drawn from an
+    ImagePyramid built in the background: the level closest to the screen
+    resolution is chosen and only its visible tiles are painted, so deep
+    zoom shows real detail and zoomed-out views of huge scans stay cheap.
+    Until the pyramid is ready the full pixmap is drawn directly.
+
+    Squint mode blurs the view by drawing a small copy scaled up with
+    smooth filtering. The copies are a chain of halvings of the fitted copy,
+    built once per image (and view size and effects) in the background, so
+    switching between the SQUINT_STRENGTHS strengths only picks another
+    level; strength s draws the copy halved s + 1 times.
+
+    Rendering has two tiers: between begin_interaction() and IDLE_DELAY_MS
+    after the last call (wheel zoom, panning) zoomed views are drawn
+    without smoothing (from the fitted copy if there is no pyramid yet);
+    once input stops, the view is repainted with smooth filtering.
+    """
+    IDLE_DELAY_MS = 150
+    SQUINT_STRENGTHS = 4
+
+    pyramid_built = pyqtSignal(object, object)  # cacheKey исходного pixmap, список уровней
+    effects_applied = pyqtSignal(object, object)  # ключ задачи, [(ключи эффектов, QImage)]
+    squint_chain_built = pyqtSignal(object, object)  # ключ вписанной копии, список уровней
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # Фон закрашиваем сами, очищать область перед отрисовкой не нужно
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent)
+        self.background = QColor("#2d2d30")
+        self.pixmap = None
+        self.source_rect = QRectF()
+        self.target_rect = QRectF()
+        self.fit = False
+        self.orientation = QTransform()  # Координаты pixmap -> координаты показа
+        self.effects = []
+        self.effects_key = ()
+        self.color_filter = None  # callable(QPixmap) -> QPixmap с цветовыми эффектами
+        self.fitted_size = QSize()
+        
+        # Полноразмерное изображение с цветовыми эффектами готовится в фоне
+        self.filtered = None
+        self.filtered_key = None  # (cacheKey pixmap, ключи эффектов)
+        self.effects_task = None
+        self.effect_stages = OrderedDict()  # (cacheKey pixmap, ключи эффектов) -> QImage
+        self.effects_applied.connect(self.on_effects_applied)
+        
+        # Прищур: уменьшенные копии вписанной копии, 0 - выключен
+        self.squint = 0
+        self.squint_chain = None
+        self.squint_key = None  # fitted_key, из которого построена цепочка
+        self.squint_task = None
+        self.squint_chain_built.connect(self.on_squint_chain_built)
+        self.fitted = None      # Копия, вписанная в окно, с цветовыми эффектами
+        self.fitted_key = None  # (cacheKey pixmap, размер в физических пикселях, эффекты)
+        self.overlay = None     # callable(painter, width, height)
+        self.overlay_state = None  # None - слой не рисуется
+        self.overlay_layer = None
+        self.overlay_layer_key = None  # (ширина, высота, масштаб экрана, overlay_state)
+        
+        # Пирамида строится только для текущего изображения и только когда понадобилась
+        self.pyramid = None
+        self.pyramid_task = None
+        self.pyramid_built.connect(self.on_pyramid_built)
+        
+        # Пока пользователь масштабирует или двигает изображение, рисуем быстро
+        self.interactive = False
+        self.idle_timer = QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(self.IDLE_DELAY_MS)
+        self.idle_timer.timeout.connect(self.end_interaction)
+
+    def begin_interaction(self):
+        """Switches to fast rendering until input has been idle for IDLE_DELAY_MS"""
+        self.interactive = True
+        self.idle_timer.start()
+
+    def end_interaction(self):
+        self.interactive = False
+        if self.pixmap is not None and not self.fit:
+            # Перерисовываем в полном качестве
+            self.update(self.target_rect.toAlignedRect())
+
+    def set_background(self, color):
+        self.background = QColor(color)
+        self.update()
+
+    def set_overlay_state(self, state):
+        """Repaints everything when the state the overlay depends on has changed;
+        None hides the overlay"""
+        if state != self.overlay_state:
+            self.overlay_state = state
+            if state is None:
+                self.overlay_layer = None
+                self.overlay_layer_key = None
+            self.update()
+
+    def overlay_pixmap(self):
+        """The overlay layer, redrawn only when the canvas size or the overlay state changes"""
+        ratio = self.devicePixelRatioF()
+        key = (self.width(), self.height(), ratio, self.overlay_state)
+        if key != self.overlay_layer_key:
+            layer = QPixmap(round(self.width() * ratio), round(self.height() * ratio))
+            layer.setDevicePixelRatio(ratio)
+            layer.fill(Qt.GlobalColor.transparent)
+            painter = QPainter(layer)
+            self.overlay(painter, self.width(), self.height())
+            painter.end()
+            self.overlay_layer = layer
+            self.overlay_layer_key = key
+        return self.overlay_layer
+
+    def set_image(self, pixmap, source_rect, target_rect, fitted_size, fit=False,
+                  orientation=None, effects=()):
+        """Shows source_rect of the oriented pixmap in target_rect. fitted_size is the whole
+        oriented image fitted to the view; fit=True means exactly that, the whole image at
+        zoom 1. effects are the colour effects as (key, QImage -> QImage) pairs"""
+        source_rect = QRectF(source_rect)
+        target_rect = QRectF(target_rect)
+        orientation = orientation if orientation is not None else QTransform()
+        effects_key = tuple(key for key, _ in effects)
+        if pixmap is not self.pixmap:
+            self.drop_effects()
+            self.effect_stages.clear()
+            self.drop_pyramid()
+            self.drop_squint_chain()
+        elif effects_key != self.effects_key:
+            self.drop_effects()
+            self.drop_pyramid()
+        self.effects = list(effects)
+        self.fitted_size = fitted_size
+        self.update_fitted(pixmap, fitted_size, orientation, effects_key)
+        if (pixmap is self.pixmap and fit == self.fit and orientation == self.orientation and
+                effects_key == self.effects_key and
+                source_rect == self.source_rect and target_rect == self.target_rect):
+            return
+        dirty = self.target_rect.united(target_rect) if not self.target_rect.isEmpty() else target_rect
+        self.pixmap = pixmap
+        self.source_rect = source_rect
+        self.target_rect = target_rect
+        self.fit = fit
+        self.orientation = orientation
+        self.effects_key = effects_key
+        if not fit:
+            self.request_pyramid(fitted_size)
+        self.update(dirty.toAlignedRect().adjusted(-1, -1, 1, 1))
+
+    def display_pixmap(self):
+        """The full-size pixmap with colour effects, or None while it is being built"""
+        if not self.effects_key:
+            return self.pixmap
+        key = (self.pixmap.cacheKey(), self.effects_key)
+        if key != self.filtered_key:
+            self.request_effects(key)
+        return self.filtered if key == self.filtered_key else None
+
+    def request_effects(self, key):
+        if self.effects_task is not None:
+            if self.effects_task.key == key:
+                return
+            self.drop_effects()
+        # Начинаем с самого длинного уже посчитанного начала цепочки эффектов
+        done = 0
+        image = None
+        for count in range(len(self.effects), 0, -1):
+            image = self.effect_stages.get((key[0], self.effects_key[:count]))
+            if image is not None:
+                self.effect_stages.move_to_end((key[0], self.effects_key[:count]))
+                done = count
+                break
+        if done == len(self.effects):
+            self.filtered = QPixmap.fromImage(image)
+            self.filtered_key = key
+            return
+        if image is None:
+            # В потоке можно работать только с QImage; у растрового QPixmap это копия без копирования данных
+            image = self.pixmap.toImage()
+        self.effects_task = ColorEffectsTask(self, key, image, self.effects[done:], self.effects_key[:done])
+        QThreadPool.globalInstance().start(self.effects_task, ImageDecodePool.PRIORITY_CURRENT)
+
+    def drop_effects(self):
+        if self.effects_task is not None:
+            self.effects_task.cancelled = True
+            self.effects_task = None
+        self.filtered = None
+        self.filtered_key = None
+
+    def on_effects_applied(self, key, stages):
+        if self.pixmap is None or key[0] != self.pixmap.cacheKey():
+            return
+        for effects_key, image in stages:
+            self.effect_stages[(key[0], effects_key)] = image
+        # Полноразмерные копии: хватает пары последних состояний
+        while len(self.effect_stages) > 4:
+            self.effect_stages.popitem(last=False)
+        if self.effects_task is None or key != self.effects_task.key:
+            return
+        self.effects_task = None
+        self.filtered = QPixmap.fromImage(stages[-1][1])
+        self.filtered_key = key
+        if not self.fit:
+            self.request_pyramid(self.fitted_size)
+            self.update(self.target_rect.toAlignedRect())
+
+    def set_squint(self, strength):
+        """Blurs the view; strength 1..SQUINT_STRENGTHS, 0 turns squint off"""
+        strength = max(0, min(self.SQUINT_STRENGTHS, strength))
+        if strength == self.squint:
+            return
+        self.squint = strength
+        if strength:
+            self.request_squint_chain()
+        else:
+            self.drop_squint_chain()
+        if self.pixmap is not None:
+            self.update(self.target_rect.toAlignedRect())
+
+    def request_squint_chain(self):
+        if self.fitted is None or self.squint_key == self.fitted_key:
+            return
+        if self.squint_task is not None:
+            if self.squint_task.key == self.fitted_key:
+                return
+            self.squint_task.cancelled = True
+        self.squint_chain = None
+        min_side = max(self.fitted.width(), self.fitted.height()) / 2 ** (self.SQUINT_STRENGTHS + 1)
+        self.squint_task = PyramidBuildTask(self.squint_chain_built, self.fitted_key,
+                                            self.fitted.toImage(), max(1, min_side))
+        QThreadPool.globalInstance().start(self.squint_task, ImageDecodePool.PRIORITY_CURRENT)
+
+    def drop_squint_chain(self):
+        if self.squint_task is not None:
+            self.squint_task.cancelled = True
+            self.squint_task = None
+        self.squint_chain = None
+        self.squint_key = None
+
+    def on_squint_chain_built(self, key, levels):
+        if self.squint_task is None or key != self.squint_task.key:
+            return
+        self.squint_task = None
+        # Уровни маленькие, переводим в QPixmap сразу
+        self.squint_chain = [QPixmap.fromImage(level) for level in levels]
+        self.squint_key = key
+        if self.squint and key == self.fitted_key:
+            self.update(self.target_rect.toAlignedRect())
+
+    def request_pyramid(self, fitted_size):
+        """Starts building the pyramid when the image is at least twice the fitted size"""
+        if self.pyramid is not None or self.pyramid_task is not None:
+            return
+        min_side = max(fitted_size.width(), fitted_size.height()) * self.devicePixelRatioF()
+        if max(self.pixmap.width(), self.pixmap.height()) < 2 * min_side:
+            return
+        # Пирамида строится из изображения с эффектами; если его еще нет, запрос повторится по готовности
+        pixmap = self.display_pixmap()
+        if pixmap is None:
+            return
+        # В потоке можно работать только с QImage; у растрового QPixmap это копия без копирования данных
+        self.pyramid_task = PyramidBuildTask(self.pyramid_built, pixmap.cacheKey(), pixmap.toImage(), min_side)
+        QThreadPool.globalInstance().start(self.pyramid_task, ImageDecodePool.PRIORITY_BACKGROUND)
+
+    def drop_pyramid(self):
+        if self.pyramid_task is not None:
+            self.pyramid_task.cancelled = True
+            self.pyramid_task = None
+        self.pyramid = None
+
+    def on_pyramid_built(self, key, levels):
+        if self.pyramid_task is None or key != self.pyramid_task.key:
+            return
+        self.pyramid_task = None
+        self.pyramid = ImagePyramid(key, self.pixmap.width(), self.pixmap.height(), levels)
+        if not self.fit:
+            self.update(self.target_rect.toAlignedRect())
+
+    def update_fitted(self, pixmap, fitted_size, orientation, effects_key):
+        ratio = self.devicePixelRatioF()
+        # Копия хранится неповернутой: размер показа переводим обратно в координаты pixmap
+        unoriented = orientation.inverted()[0].mapRect(QRectF(0, 0, fitted_size.width(), fitted_size.height()))
+        size = QSize(round(unoriented.width() * ratio), round(unoriented.height() * ratio))
+        if pixmap is not self.pixmap:
+            self.fitted_key = None
+        key = (pixmap.cacheKey(), size.width(), size.height(), effects_key)
+        if key == self.fitted_key:
+            return
+        self.fitted_key = key
+        if size == pixmap.size() or size.isEmpty():
+            fitted = pixmap
+        else:
+            fitted = pixmap.scaled(
+                size, Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation
+            )
+        # Цветовые эффекты - на копии размером с окно, а не на полном изображении
+        if self.color_filter is not None and effects_key:
+            fitted = self.color_filter(fitted)
+        self.fitted = fitted
+        if self.squint:
+            self.request_squint_chain()
+
+    def clear(self):
+        self.drop_pyramid()
+        self.drop_effects()
+        self.drop_squint_chain()
+        self.effect_stages.clear()
+        self.pixmap = None
+        self.fitted = None
+        self.fitted_key = None
+        self.target_rect = QRectF()
+        self.update()
+
+    def paint_transform(self):
+        """Maps pixmap coordinates to widget coordinates: orientation, then zoom and pan"""
+        source = self.source_rect
+        target = self.target_rect
+        scale_x = target.width() / max(1e-9, source.width())
+        scale_y = target.height() / max(1e-9, source.height())
+        view = QTransform(scale_x, 0, 0, scale_y,
+                          target.x() - source.x() * scale_x, target.y() - source.y() * scale_y)
+        return self.orientation * view
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(event.rect(), self.background)
+        if self.pixmap is not None and not self.source_rect.isEmpty():
+            painter.setTransform(self.paint_transform())
+            # Видимая часть в координатах pixmap (до поворота и отражений)
+            source = self.orientation.inverted()[0].mapRect(self.source_rect)
+            squint_level = None
+            if self.squint and self.squint_chain and self.squint_key == self.fitted_key:
+                squint_level = self.squint_chain[min(self.squint, len(self.squint_chain) - 1)]
+            use_fitted = self.fit or (self.interactive and self.pyramid is None)
+            full = None if use_fitted or squint_level is not None else self.display_pixmap()
+            if squint_level is not None:
+                # Прищур: маленькая копия, растянутая со сглаживанием
+                factor_x = squint_level.width() / self.pixmap.width()
+                factor_y = squint_level.height() / self.pixmap.height()
+                painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, True)
+                painter.drawPixmap(source, squint_level, QRectF(source.x() * factor_x, source.y() * factor_y,
+                                                                source.width() * factor_x, source.height() * factor_y))
+            elif full is None:
+                # Вписанная копия: при масштабе 1 рисуется пиксель в пиксель,
+                # при увеличении в быстром режиме - без сглаживания, а также
+                # пока полноразмерная копия с эффектами готовится в фоне
+                factor_x = self.fitted.width() / self.pixmap.width()
+                factor_y = self.fitted.height() / self.pixmap.height()
+                painter.drawPixmap(source, self.fitted, QRectF(source.x() * factor_x, source.y() * factor_y,
+                                                               source.width() * factor_x, source.height() * factor_y))
+            elif self.pyramid is not None:
+                # Уровень, ближайший к разрешению экрана; рисуются только видимые плитки
+                scale = self.target_rect.width() * self.devicePixelRatioF() / max(1.0, self.source_rect.width())
+                index = self.pyramid.level_for_scale(scale)
+                painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, not self.interactive)
+                if index is None:
+                    painter.drawPixmap(source, full, source)
+                else:
+                    self.pyramid.draw(painter, index, source, source)
+            else:
+                painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, True)
+                painter.drawPixmap(source, full, source)
+            painter.resetTransform()
+        if self.overlay is not None and self.overlay_state is not None:
+            # Из готового слоя копируется только перерисовываемая часть
+            rect = QRectF(event.rect())
+            ratio = self.devicePixelRatioF()
+            painter.drawPixmap(rect, self.overlay_pixmap(),
+                               QRectF(rect.x() * ratio, rect.y() * ratio, rect.width() * ratio, rect.height() * ratio))
+        painter.end()
+
+# Таймер поверх изображения: перерисовывает только свой прямоугольник
+class TimerOverlay(QWidget):
+    """Session timer text drawn over the image.
+
+    Used instead of a QLabel in a styled container: there is no per-tick
+    stylesheet work, colours and font are set once per theme by set_style(),
+    and each line keeps its QStaticText layout while its text is unchanged.
+    The size is measured with every digit replaced by a zero, so a ticking
+    countdown keeps the same geometry and a tick repaints only this widget's
+    rectangle instead of re-laying out the overlay.
+    """
+    PADDING_X = 12
+    PADDING_Y = 4
+    RADIUS = 4
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Fixed)
+        self.text = ""
+        self.lines = []  # (строка, QStaticText)
+        self.background = QColor(0, 0, 0, 120)
+        self.foreground = QColor(Qt.GlobalColor.white)
+        self.text_font = QFont()
+        self.text_font.setBold(True)
+        self.text_size = QSize(0, 0)
+
+    def set_style(self, background, foreground, families, pixel_size):
+        """Colours and font; called when the theme or the language changes"""
+        self.background = QColor(background)
+        self.foreground = QColor(foreground)
+        font = QFont()
+        font.setFamilies(families)
+        font.setPixelSize(pixel_size)
+        font.setBold(True)
+        if font != self.text_font:
+            self.text_font = font
+            # Раскладка строк зависит от шрифта
+            self.lines = [(line, self.static_line(line)) for line, _ in self.lines]
+            self.update_text_size()
+        self.update()
+
+    def setText(self, text):
+        if text == self.text:
+            return
+        self.text = text
+        previous = dict(self.lines)
+        self.lines = [(line, previous.get(line) or self.static_line(line)) for line in text.split("\n")]
+        self.update_text_size()
+        self.update()
+
+    def static_line(self, line):
+        """QStaticText laid out with text_font, so its size is right before the first paint"""
+        static_text = QStaticText(line)
+        static_text.prepare(QTransform(), self.text_font)
+        return static_text
+
+    def update_text_size(self):
+        metrics = QFontMetrics(self.text_font)
+        width = max((metrics.horizontalAdvance(re.sub(r"\d", "0", line)) for line, _ in self.lines), default=0)
+        size = QSize(width, metrics.height() * len(self.lines))
+        if size != self.text_size:
+            self.text_size = size
+            self.updateGeometry()
+
+    def sizeHint(self):
+        return self.text_size + QSize(2 * self.PADDING_X, 2 * self.PADDING_Y)
+
+    def minimumSizeHint(self):
+        return self.sizeHint()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(self.background)
+        painter.drawRoundedRect(QRectF(self.rect()), self.RADIUS, self.RADIUS)
+        painter.setFont(self.text_font)
+        painter.setPen(self.foreground)
+        metrics = QFontMetrics(self.text_font)
+        y = self.PADDING_Y
+        for _, static_text in self.lines:
+            # Строки по центру, как в QLabel с AlignCenter
+            x = (self.width() - static_text.size().width()) / 2
+            painter.drawStaticText(QPointF(x, y), static_text)
+            y += metrics.height()
+        painter.end()
+
 # Основное окно показа изображений (интерфейс 2)
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -3195,9 +5318,9 @@ class MainWindow(QMainWindow):
         
         # Инициализируем историю просмотров
         if self.settings.get("save_history", True):
-            self.displayed_history = self.config_manager.load_history()
+            self.displayed_history = ImageCollection(self.config_manager.load_history())
         else:
-            self.displayed_history = []
+            self.displayed_history = ImageCollection()
         
         # Применяем тему
         theme_manager.set_theme(self.settings.get("theme", "dark"))
@@ -3216,6 +5339,23 @@ class MainWindow(QMainWindow):
         # Загружаем статистику просмотров для папок
         self.folder_stats = self.config_manager.load_folder_stats()
         
+        # Индекс библиотеки позволяет не сканировать заново неизменившиеся папки
+        self.library_index = LibraryIndex(self.config_manager.library_index_file)
+        self.image_files = ImageCollection(ordered=False)  # Порядок не важен, удаление - перестановкой
+        self.image_sampler = ImageSampler(self.image_files, self.displayed_history)
+        # Очередь предвыборки: следующие изображения декодируются заранее, пока идет показ текущего
+        self.upcoming_images = deque()
+        self.prefetch_requests = {}  # путь -> request id фоновой загрузки
+        self.max_prefetch = 6
+        self.scanner_thread = None
+        self.scan_staging = None  # Изображения папки, сканируемой во время сессии
+        self.session_start_pending = False  # Сессия ждет первую порцию изображений
+        
+        # После сканирования изменения в папке подхватываются без повторного сканирования
+        self.folder_watcher = FolderWatcher(self.supported_extensions, self.library_index, self)
+        self.folder_watcher.files_added.connect(self.on_watched_files_added)
+        self.folder_watcher.files_removed.connect(self.on_watched_files_removed)
+        
         # Если есть сохраненная папка, загружаем изображения без запуска сессии
         if self.settings.get("folder"):
             current_folder = os.path.abspath(self.settings["folder"])
@@ -3225,11 +5365,7 @@ class MainWindow(QMainWindow):
             
             # Загружаем изображения из сохраненной папки без запуска сессии
             if os.path.isdir(current_folder):
-                self.scanner_thread = FolderScannerThread(current_folder, self.supported_extensions)
-                self.scanner_thread.scanned.connect(self.on_images_scanned)
-                self.scanner_thread.error.connect(self.on_scanner_error)
-                self.scanner_thread.progress.connect(self.on_progress)
-                self.scanner_thread.start()
+                self.start_folder_scan(current_folder)
         
         # Создаем центральный виджет
         self.central_widget = QWidget()
@@ -3243,7 +5379,8 @@ class MainWindow(QMainWindow):
 
         # Загрузка настроек и истории
         self.settings = self.config_manager.load_settings()
-        self.displayed_history = self.config_manager.load_history()
+        self.displayed_history = ImageCollection(self.config_manager.load_history())
+        self.image_sampler.history = self.displayed_history
         
         # Создаем контейнер для изображения
         self.image_container = QWidget()
@@ -3251,14 +5388,14 @@ class MainWindow(QMainWindow):
         self.image_container.layout().setContentsMargins(0, 0, 0, 0)
         self.image_container.layout().setSpacing(0)
         
-        # Область для изображения (на весь экран)
-        self.image_label = QLabel()
-        self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.image_label.setStyleSheet("background-color: #2d2d30;")
-        self.image_label.setMinimumSize(1, 1)  # Устанавливаем минимальный размер
+        # Область для изображения (на весь экран), рисует изображение и сетку сама
+        self.image_canvas = ImageCanvas()
+        self.image_canvas.setMinimumSize(1, 1)  # Устанавливаем минимальный размер
+        self.image_canvas.overlay = self.draw_grid
+        self.image_canvas.color_filter = self.apply_color_effects
         
-        # Создаем layout для image_label для правильного центрирования контента
-        image_layout = QVBoxLayout(self.image_label)
+        # Создаем layout для image_canvas для правильного центрирования контента
+        image_layout = QVBoxLayout(self.image_canvas)
         image_layout.setContentsMargins(0, 0, 0, 0)
         image_layout.setAlignment(Qt.AlignmentFlag.AlignCenter)
         
@@ -3285,8 +5422,8 @@ class MainWindow(QMainWindow):
         # Добавляем логотип в layout изображения
         image_layout.addWidget(self.menu_logo)
         
-        # Добавляем image_label в контейнер
-        self.image_container.layout().addWidget(self.image_label)
+        # Добавляем image_canvas в контейнер
+        self.image_container.layout().addWidget(self.image_canvas)
         
         # Добавляем контейнер с изображением в основной layout
         self.main_layout.addWidget(self.image_container)
@@ -3303,27 +5440,10 @@ class MainWindow(QMainWindow):
         overlay_layout.setContentsMargins(10, 10, 10, 10)
         overlay_layout.setSpacing(10)
 
-        # Таймер сверху
-        timer_container = QWidget()
-        timer_container.setStyleSheet("""
-            QWidget {
-                background-color: rgba(0, 0, 0, 120);
-                border-radius: 4px;
-                padding: 2px 8px;
-            }
-        """)
-        timer_layout = QHBoxLayout(timer_container)
-        timer_layout.setContentsMargins(0, 0, 0, 0)
-        
-        self.timer_label = QLabel()
-        self.timer_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.timer_label.setStyleSheet("""
-            font-weight: bold;
-            color: white;
-            padding: 2px;
-        """)
-        timer_layout.addWidget(self.timer_label)
-        overlay_layout.addWidget(timer_container, 0, Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignTop)
+        # Таймер сверху; обновляется каждую секунду, поэтому рисует себя сам, без стилей
+        self.timer_overlay = TimerOverlay()
+        self.timer_alignment = Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignTop
+        overlay_layout.addWidget(self.timer_overlay, 0, self.timer_alignment)
         
         # Добавляем индикатор прогресса
         self.progress_label = QLabel()
@@ -3455,6 +5575,20 @@ class MainWindow(QMainWindow):
         self.bw_button.clicked.connect(self.apply_bw_filter)
         tools_layout.addWidget(self.bw_button)
 
+        self.values_button = QPushButton()
+        self.values_button.setIcon(create_themed_icon("resources/values0.png"))
+        self.values_button.setIconSize(QSize(24, 24))
+        self.values_button.clicked.connect(self.cycle_value_mode)
+        tools_layout.addWidget(self.values_button)
+
+        self.squint_button = QPushButton()
+        self.squint_button.setIcon(create_themed_icon("resources/squint0.png"))
+        self.squint_button.setIconSize(QSize(24, 24))
+        self.squint_button.setToolTip(tr("Squint") + " (Q, [ ])")
+        self.squint_button.setCheckable(True)
+        self.squint_button.clicked.connect(self.toggle_squint)
+        tools_layout.addWidget(self.squint_button)
+
         self.flip_v_button = QPushButton()
         self.flip_v_button.setIcon(create_themed_icon("resources/flipv.png"))
         self.flip_v_button.setIconSize(QSize(24, 24))
@@ -3596,7 +5730,8 @@ class MainWindow(QMainWindow):
 
         # Применяем стиль к остальным кнопкам
         for button in [self.open_file_button, self.copy_image_button, self.delete_button,
-                       self.grid_button, self.bw_button, self.flip_v_button,
+                       self.grid_button, self.bw_button, self.values_button, self.squint_button,
+                       self.flip_v_button,
                        self.flip_h_button, self.rotate_button, self.restore_button,
                        self.show_timer_button, self.always_on_top_button]:
             button.setStyleSheet(button_style)
@@ -3609,9 +5744,8 @@ class MainWindow(QMainWindow):
         self.overlay_controls = [buttons_container]
 
         # Настройки по умолчанию
-        self.image_files = []             # список путей к изображениям
         self.accepted_count = 0           # количество показанных изображений
-        self.session_images = []          # список показанных изображений (без пропусков)
+        self.session_images = ImageCollection()  # список показанных изображений (без пропусков)
         self.history_index = -1           # индекс текущего изображения
         self.current_image_path = None
         self.current_pixmap = None
@@ -3620,10 +5754,15 @@ class MainWindow(QMainWindow):
         self.is_session_completed = False  # Флаг завершения сессии
         self.is_in_break = False  # Флаг режима перерыва
 
-        # Добавляем ограничение на размер кэша (увеличиваем для лучшей производительности)
-        self.max_cache_size = 100  # Увеличиваем размер кэша
-        self.pixmap_cache = {}
-        self.cache_access_order = []  # Для LRU кэширования
+        # Декодирование и все копии изображений в памяти - в одном сервисе с общим бюджетом;
+        # медленные форматы после первого показа берутся из дискового кэша уменьшенных копий
+        disk_cache_mb = self.settings.get("disk_cache_mb", 1024)
+        disk_cache = DiskImageCache(
+            os.path.join(self.config_manager.config_dir, "cache"), disk_cache_mb * 1024 * 1024
+        ) if disk_cache_mb > 0 else None
+        self.image_service = ImageService(self.settings.get("pixmap_cache_mb", 0) * 1024 * 1024, disk_cache, self)
+        # Файл, сохраненный поверх старого, меняет папку - его копии в памяти устарели
+        self.folder_watcher.folders_changed.connect(self.image_service.invalidate_folders)
         
         # Добавляем счетчик попыток загрузки
         self.load_attempts = 0
@@ -3639,14 +5778,15 @@ class MainWindow(QMainWindow):
         self.break_timer.setSingleShot(True)
         self.break_timer.timeout.connect(self.start_session)
 
-        # Поток сканирования папки
-        self.scanner_thread = None
-
         # Добавляем флаги для глобальных эффектов
         self.is_bw = False
         self.flip_v_active = False
         self.flip_h_active = False
         self.rotation_angle = 0
+        self.value_mode = 0  # Индекс в VALUE_STUDY_MODES
+        self.squint_strength = 2  # Сила размытия в режиме прищура (1-4)
+        # Результаты цветовых эффектов: (cacheKey изображения, эффекты) -> QPixmap
+        self.effects_cache = OrderedDict()
 
         # Делаем кнопки эффектов переключаемыми
         self.bw_button.setCheckable(True)
@@ -3661,12 +5801,12 @@ class MainWindow(QMainWindow):
         self.pan_x = 0  # Смещение по X при панорамировании
         self.pan_y = 0  # Смещение по Y при панорамировании
         
-        # Убираем отслеживание колеса мыши с image_label
-        self.image_label.setMouseTracking(True)
+        # Убираем отслеживание колеса мыши с image_canvas
+        self.image_canvas.setMouseTracking(True)
 
         # Инициализируем видимость таймера в соответствии с настройками
         if not self.settings.get("show_timer", True):
-            self.timer_label.hide()
+            self.timer_overlay.hide()
 
         self.update_timer_label()
 
@@ -3683,6 +5823,8 @@ class MainWindow(QMainWindow):
         self.grid_button.setShortcut("G")  # Новый хоткей для сетки
         self.delete_button.setShortcut("Delete")
         self.bw_button.setShortcut("B")
+        self.values_button.setShortcut("P")
+        self.squint_button.setShortcut("Q")
         self.flip_v_button.setShortcut("V")
         self.flip_h_button.setShortcut("H")
         self.rotate_button.setShortcut("R")
@@ -3691,8 +5833,20 @@ class MainWindow(QMainWindow):
         self.always_on_top_button.setShortcut("A")
         self.settings_button.setShortcut("Ctrl+,")
 
-        # Добавляем словарь для отслеживания загрузчиков
-        self.image_loaders = {}
+        # До on_image_loaded доходит только последний запрос
+        self.image_service.loaded.connect(self.on_image_decoded)
+        self.image_service.failed.connect(self.on_image_decode_failed)
+        self.current_load_id = None
+        # Изображения декодируются под размер экрана; полный размер - только при увеличении
+        self.full_load_id = None
+        self.full_resolution_path = None
+        self.clipboard_load_id = None  # Полный размер для буфера обмена
+        
+        # Предвыборка следующих изображений перезапускается после каждого перехода
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(0)  # После того как обработчик перехода обновит history_index
+        self.prefetch_timer.timeout.connect(self.schedule_prefetch)
 
         # Добавляем переменную для отслеживания времени перерыва
         self.break_remaining_time = 0
@@ -3702,8 +5856,9 @@ class MainWindow(QMainWindow):
 
         # Добавляем переменные для сетки
         self.show_grid = False
-        self.grid_h_lines = 1  # Количество горизонтальных линий (1-4)
-        self.grid_v_lines = 1  # Количество вертикальных линий (1-4)
+        self.grid_h_lines = 1  # Количество горизонтальных линий (1-3 или 7)
+        self.grid_v_lines = 1  # Количество вертикальных линий (1-3 или 7)
+        self.grid_diagonals = self.settings.get("grid_diagonals", False)  # Диагонали кадра
         self.grid_color = Qt.GlobalColor.white  # Цвет сетки
         self.grid_line_width = 1  # Толщина линий сетки
 
@@ -3735,6 +5890,13 @@ class MainWindow(QMainWindow):
         
         reset_zoom_shortcut = QShortcut(QKeySequence("Ctrl+0"), self)
         reset_zoom_shortcut.activated.connect(self.reset_zoom)
+        
+        # Сила прищура
+        squint_less_shortcut = QShortcut(QKeySequence("["), self)
+        squint_less_shortcut.activated.connect(lambda: self.change_squint_strength(-1))
+        
+        squint_more_shortcut = QShortcut(QKeySequence("]"), self)
+        squint_more_shortcut.activated.connect(lambda: self.change_squint_strength(1))
 
         # Инициализируем переменные для таймера
         self.is_paused = False
@@ -3774,16 +5936,14 @@ class MainWindow(QMainWindow):
         super().leaveEvent(event)
 
     def hide_controls(self):
-        timer_container = self.timer_label.parent()
         if not self.show_timer_button.isChecked():
-            timer_container.hide()
+            self.timer_overlay.hide()
         for widget in self.overlay_controls:
             widget.hide()
 
     def show_controls(self):
-        timer_container = self.timer_label.parent()
         if self.show_timer_button.isChecked():
-            timer_container.show()
+            self.timer_overlay.show()
         for widget in self.overlay_controls:
             widget.show()
 
@@ -3860,9 +6020,11 @@ class MainWindow(QMainWindow):
             
         # Применяем настройки сетки
         if (new_settings.get("grid_h_lines") != old_settings.get("grid_h_lines") or
-            new_settings.get("grid_v_lines") != old_settings.get("grid_v_lines")):
+            new_settings.get("grid_v_lines") != old_settings.get("grid_v_lines") or
+            new_settings.get("grid_diagonals") != old_settings.get("grid_diagonals")):
             self.grid_h_lines = new_settings["grid_h_lines"]
             self.grid_v_lines = new_settings["grid_v_lines"]
+            self.grid_diagonals = new_settings.get("grid_diagonals", False)
             if self.show_grid:
                 self.update_image_display()
         
@@ -3895,6 +6057,8 @@ class MainWindow(QMainWindow):
         self.grid_button.setToolTip(tr("Toggle grid") + " (G)")
         self.delete_button.setToolTip(tr("Move to trash") + " (Delete)")
         self.bw_button.setToolTip(tr("B/W filter") + " (B)")
+        self.values_button.setToolTip(tr("Value study") + ": " + tr(VALUE_STUDY_MODES[self.value_mode][2]) + " (P)")
+        self.squint_button.setToolTip(tr("Squint") + " (Q, [ ])")
         self.flip_v_button.setToolTip(tr("Flip vertically") + " (V)")
         self.flip_h_button.setToolTip(tr("Flip horizontally") + " (H)")
         self.rotate_button.setToolTip(tr("Rotate 90°") + " (R)")
@@ -3917,18 +6081,8 @@ class MainWindow(QMainWindow):
     def update_timer_label(self):
         """Обновление текста в таймере и его видимости"""
         pos = self.settings.get("timer_position", "center")
-        timer_container = self.timer_label.parent()
         
-        # Устанавливаем базовый стиль для таймера - без жестко заданного цвета текста
-        # Кэшируем стиль, чтобы не пересоздавать его каждый раз
-        if not hasattr(self, '_timer_base_style'):
-            self._timer_base_style = """
-                font-weight: bold;
-                padding: 2px;
-            """
-        self.timer_label.setStyleSheet(self._timer_base_style)
-        
-        # Устанавливаем выравнивание для контейнера таймера
+        # Устанавливаем выравнивание для таймера
         # Кэшируем выравнивания, чтобы не пересоздавать их каждый раз
         if not hasattr(self, '_timer_alignments'):
             self._timer_alignments = {
@@ -3938,7 +6092,10 @@ class MainWindow(QMainWindow):
             }
         
         alignment = self._timer_alignments.get(pos, self._timer_alignments["center"])
-        self.overlay_widget.layout().setAlignment(timer_container, alignment)
+        # Выравнивание меняет раскладку оверлея, поэтому задаем его только при изменении
+        if alignment != self.timer_alignment:
+            self.timer_alignment = alignment
+            self.overlay_widget.layout().setAlignment(self.timer_overlay, alignment)
             
         if self.settings.get("show_timer", True):
             if self.settings.get("unlimited_time", False):
@@ -3951,7 +6108,7 @@ class MainWindow(QMainWindow):
                 else:
                     timer_text = f"{session_text}: {accepted_count}"
                     
-                self.timer_label.setText(timer_text)
+                self.timer_overlay.setText(timer_text)
             else:
                 session_text = tr("Session")
                 accepted_count = str(self.accepted_count)
@@ -3973,34 +6130,30 @@ class MainWindow(QMainWindow):
                 else:
                     timer_text = f"{session_part} | {remaining_part}"
                 
-                self.timer_label.setText(timer_text)
+                self.timer_overlay.setText(timer_text)
             
             # Настройка обработчика нажатия в зависимости от состояния
             if self.is_in_break:
                 # В перерыве - позволяем пропустить перерыв по клику
-                self.timer_label.setCursor(Qt.CursorShape.PointingHandCursor)
-                self.timer_label.mousePressEvent = lambda event: self.skip_break()
+                self.timer_overlay.setCursor(Qt.CursorShape.PointingHandCursor)
+                self.timer_overlay.mousePressEvent = lambda event: self.skip_break()
             elif self.is_session_completed:
                 # Сессия завершена - позволяем начать новую по клику
-                self.timer_label.setCursor(Qt.CursorShape.PointingHandCursor)
-                self.timer_label.mousePressEvent = lambda event: self.start_new_session()
+                self.timer_overlay.setCursor(Qt.CursorShape.PointingHandCursor)
+                self.timer_overlay.mousePressEvent = lambda event: self.start_new_session()
             else:
                 # Активная сессия - отключаем обработку кликов
-                self.timer_label.setCursor(Qt.CursorShape.ArrowCursor)
-                self.timer_label.mousePressEvent = lambda event: None
+                self.timer_overlay.setCursor(Qt.CursorShape.ArrowCursor)
+                self.timer_overlay.mousePressEvent = lambda event: None
                 
-            self.timer_label.show()
+            self.timer_overlay.show()
         else:
-            self.timer_label.hide()
+            self.timer_overlay.hide()
 
     def load_images(self, folder):
         """Загружает изображения из выбранной папки"""
         if os.path.isdir(folder):
-            self.scanner_thread = FolderScannerThread(folder, self.supported_extensions)
-            self.scanner_thread.scanned.connect(self.on_images_scanned)
-            self.scanner_thread.error.connect(self.on_scanner_error)
-            self.scanner_thread.progress.connect(self.on_progress)
-            self.scanner_thread.start()
+            self.start_folder_scan(folder)
             
             # Обновляем статистику для текущей папки
             if folder not in self.folder_stats:
@@ -4008,19 +6161,129 @@ class MainWindow(QMainWindow):
             # Сохраняем обновленную статистику
             self.config_manager.save_folder_stats(self.folder_stats)
 
+    def get_scan_workers(self, folder):
+        """Число потоков сканирования для папки: самое длинное совпадение из scan_workers_overrides,
+        иначе общая настройка scan_workers"""
+        workers = self.settings.get("scan_workers", 4)
+        folder = os.path.normcase(os.path.abspath(folder))
+        best = ""
+        for prefix, value in self.settings.get("scan_workers_overrides", {}).items():
+            prefix = os.path.normcase(os.path.abspath(prefix))
+            if (folder == prefix or folder.startswith(prefix.rstrip(os.sep) + os.sep)) and len(prefix) > len(best):
+                best, workers = prefix, value
+        try:
+            return max(1, int(workers))
+        except (TypeError, ValueError):
+            return 1
+
+    def start_folder_scan(self, folder):
+        """Запускает сканирование папки, останавливая предыдущее"""
+        if self.scanner_thread is not None:
+            self.scanner_thread.stop()
+        self.folder_watcher.stop()
+        # Идущая сессия продолжает показывать старый список, новый подменит его по окончании сканирования
+        session_active = getattr(self, 'current_image_path', None) and not self.is_session_completed
+        if session_active:
+            self.scan_staging = ImageCollection(ordered=False)
+        else:
+            self.scan_staging = None
+            self.image_files.clear()
+            self.image_sampler.reset()
+            self.clear_prefetch()
+        
+        scanner = FolderScannerThread(folder, self.supported_extensions, self.library_index,
+                                      self.get_scan_workers(folder), self)
+        scanner.scanned.connect(self.on_images_scanned)
+        scanner.removed.connect(self.on_images_removed)
+        scanner.completed.connect(self.on_scan_completed)
+        scanner.error.connect(self.on_scanner_error)
+        scanner.progress.connect(self.on_progress)
+        scanner.finished.connect(self.on_scanner_finished)
+        self.scanner_thread = scanner
+        scanner.start()
+        return scanner
+
+    def on_scanner_finished(self):
+        scanner = self.sender()
+        if scanner is self.scanner_thread:
+            self.scanner_thread = None
+        scanner.deleteLater()
+
     def on_images_scanned(self, files):
-        """Обработчик завершения сканирования папки"""
-        self.image_files = files
+        """Добавляет очередную порцию найденных изображений"""
+        # Порции от остановленного сканера больше не нужны
+        if self.sender() is not self.scanner_thread:
+            return
+        if self.scan_staging is not None:
+            self.scan_staging.extend(files)
+            return
+        self.image_files.extend(files)
+        self.image_sampler.add(files)
         
+        # Сессия, запрошенная до окончания сканирования, стартует с первой порции
+        if self.session_start_pending and self.image_files:
+            self.session_start_pending = False
+            self.start_session()
+
+    def on_images_removed(self, removed):
+        """Убирает из списка изображения, исчезнувшие с момента прошлого сканирования"""
+        if self.sender() is not self.scanner_thread:
+            return
+        if self.scan_staging is not None:
+            self.scan_staging.discard_many(removed)
+        self.discard_images(removed)
+        logging.info(f"Removed missing images: {len(removed)}")
+
+    def discard_images(self, removed):
+        """Убирает исчезнувшие с диска изображения из списка и кэша"""
+        removed_set = set(removed)
+        self.image_files.discard_many(removed_set)
+        self.image_service.invalidate_many(removed_set)
+
+    def on_watched_files_added(self, files):
+        """Добавляет изображения, появившиеся в папке во время работы"""
+        self.image_files.extend(files)
+        self.image_sampler.add(files)
+        logging.info(f"New images in folder: {len(files)}")
+
+    def on_watched_files_removed(self, files):
+        """Убирает изображения, удаленные или переименованные вне программы"""
+        self.discard_images(files)
+        logging.info(f"Images removed from folder: {len(files)}")
+
+    def on_scan_completed(self, total_images):
+        """Обработчик завершения сканирования папки"""
+        if self.sender() is not self.scanner_thread:
+            return
+            
         # Скрываем индикатор прогресса
         self.progress_label.hide()
+        self.session_start_pending = False
+        
+        # Папка сканировалась во время сессии - теперь подменяем список целиком
+        if self.scan_staging is not None:
+            if self.scan_staging:
+                self.image_files = self.scan_staging
+                self.image_sampler = ImageSampler(self.image_files, self.displayed_history)
+                self.image_sampler.add(self.image_files)
+                self.clear_prefetch()
+            self.scan_staging = None
+        
+        # Дальше изменения в папке отслеживаются без пересканирования
+        scanner = self.sender()
+        self.folder_watcher.watch(scanner.root, scanner.directories)
+        
+        # Если открыто окно настроек, обновляем в нем информацию о только что просканированной папке
+        for child in self.children():
+            if isinstance(child, SettingsDialog):
+                child.on_folder_scanned(scanner.root, total_images)
+                break
         
-        if not files:
-            NoticeDialog.show_warning(self, tr("Warning"), tr("No images found in selected folder and subfolders"))
+        if not total_images:
             return
             
         # Логируем количество найденных изображений
-        logging.info(f"Found images: {len(files)}")
+        logging.info(f"Found images: {len(self.image_files)}")
             
         # Обновляем статистику для текущей папки
         current_folder = os.path.abspath(self.settings.get("folder", ""))
@@ -4028,12 +6291,6 @@ class MainWindow(QMainWindow):
             self.folder_stats[current_folder] = 0
         self.config_manager.save_folder_stats(self.folder_stats)
         
-        # Если открыто окно настроек, обновляем в нем информацию
-        for child in self.children():
-            if isinstance(child, SettingsDialog):
-                child.update_folder_label(current_folder)
-                break
-        
         # Если это первая загрузка папки, начинаем сессию
         if not self.current_image_path and not self.settings.get("folder"):
             self.start_session()
@@ -4045,9 +6302,10 @@ class MainWindow(QMainWindow):
             NoticeDialog.show_error(self, tr("Error"), error_message)
         logging.error(error_message)
 
-    def on_progress(self, processed_files, total_files):
-        progress = min(int((processed_files / total_files) * 100), 100)
-        self.progress_label.setText(f"{tr('Scanning')}: {progress}%")
+    def on_progress(self, folders_visited, images_found):
+        if self.sender() is not self.scanner_thread:
+            return
+        self.progress_label.setText(f"{tr('Scanning')}: {images_found} ({tr('folders')}: {folders_visited})")
         self.progress_label.show()
 
     def start_session(self):
@@ -4068,11 +6326,17 @@ class MainWindow(QMainWindow):
             # Показываем логотип меню, если нет изображений
             if hasattr(self, 'menu_logo'):
                 self.menu_logo.show()
+            
+            # Папка еще сканируется - начнем сессию, как только придет первая порция
+            if self.scanner_thread is not None:
+                self.session_start_pending = True
+                self.timer_overlay.setText(tr("Scanning") + "...")
+                return
                 
-            self.timer_label.setText(tr("No images to display. Select a folder.") + 
+            self.timer_overlay.setText(tr("No images to display. Select a folder.") + 
                                    "\n" + tr("Try using B, V, H, R, and G keys to experiment with effects on the logo."))
-            self.timer_label.setCursor(Qt.CursorShape.ArrowCursor)
-            self.timer_label.mousePressEvent = None
+            self.timer_overlay.setCursor(Qt.CursorShape.ArrowCursor)
+            self.timer_overlay.mousePressEvent = None
             return
             
         # Сохраняем предыдущую сессию перед созданием новой, если она существует
@@ -4082,7 +6346,7 @@ class MainWindow(QMainWindow):
             
         # Сбрасываем счетчик просмотренных изображений
         self.accepted_count = 0  # Начинаем с 0, первое изображение увеличит до 1
-        self.session_images = []  # Новый список для текущей сессии
+        self.session_images = ImageCollection()  # Новый список для текущей сессии
         
         # Устанавливаем или сбрасываем время
         self.remaining_time = self.settings["display_time"]
@@ -4115,28 +6379,56 @@ class MainWindow(QMainWindow):
         # Запускаем новую сессию
         self.start_session()
 
-    def apply_image_effects(self, pixmap):
-        current = pixmap.copy()
-        
-        # Применяем ч/б фильтр
-        if self.is_bw:
-            image = current.toImage().convertToFormat(QImage.Format.Format_Grayscale8)
-            current = QPixmap.fromImage(image)
-            
-        # Применяем отражения
+    def color_effects(self):
+        """Активные цветовые эффекты по порядку применения: (ключ, функция QImage -> QImage)"""
+        effects = []
+        values, levels, _ = VALUE_STUDY_MODES[self.value_mode]
+        # Применяем ч/б фильтр; этюд на валёры тоже работает с яркостью
+        if self.is_bw or values or levels:
+            effects.append(("bw", lambda image: image.convertToFormat(QImage.Format.Format_Grayscale8)))
+        # Постеризация и контраст - таблицей на 256 значений, без обхода пикселей
+        if values or levels:
+            lut = value_study_lut(values, levels)
+            effects.append((("values", values, levels), lambda image: remap_grayscale(image, lut)))
+        return effects
+
+    def apply_color_effects(self, pixmap):
+        """Применяет цветовые эффекты; результат запоминается для изображения и набора эффектов"""
+        effects = self.color_effects()
+        if not effects:
+            return pixmap
+        key = (pixmap.cacheKey(), tuple(effect_key for effect_key, _ in effects))
+        cached = self.effects_cache.get(key)
+        if cached is not None:
+            self.effects_cache.move_to_end(key)
+            return cached
+        result = QPixmap.fromImage(run_color_effects(pixmap.toImage(), effects))
+        self.effects_cache[key] = result
+        # Хватает вписанной копии и полного изображения для пары последних состояний
+        while len(self.effects_cache) > 4:
+            self.effects_cache.popitem(last=False)
+        return result
+
+    def orientation_transform(self, size):
+        """Отражения и поворот как преобразование координат изображения размера size"""
         transform = QTransform()
+        # Применяем отражения
         if self.flip_v_active:
             transform.scale(1, -1)
         if self.flip_h_active:
             transform.scale(-1, 1)
-            
         # Применяем поворот
         if self.rotation_angle != 0:
             transform.rotate(self.rotation_angle)
-            
+        # Как и QPixmap.transformed, сдвигаем результат в положительные координаты
+        return QPixmap.trueMatrix(transform, size.width(), size.height())
+
+    def apply_image_effects(self, pixmap):
+        """Все эффекты, примененные к копии изображения (для логотипа и буфера обмена);
+        основной вид применяет их при отрисовке"""
+        current = self.apply_color_effects(pixmap)
         if self.flip_v_active or self.flip_h_active or self.rotation_angle != 0:
-            current = current.transformed(transform)
-            
+            current = current.transformed(self.orientation_transform(current.size()))
         return current
 
     def pause(self):
@@ -4193,36 +6485,30 @@ class MainWindow(QMainWindow):
         # Сбрасываем флаг воспроизведения звука при переходе к новому изображению
         self.timer_sound_playing = False
 
-        # Получаем список доступных изображений
-        if self.settings["save_history"]:
-            # Если история включена, исключаем просмотренные изображения
-            available = [img for img in self.image_files if img not in self.displayed_history]
+        # Выбираем следующее изображение; при включенной истории - только непросмотренные
+        next_image = self.take_next_image()
+        if next_image is None and self.settings["save_history"] and self.image_files:
             # Если все изображения просмотрены, очищаем историю и показываем уведомление
-            if not available:
-                NoticeDialog.show_warning(self, tr("Warning"), tr("All images have been viewed. Starting over."))
-                self.displayed_history.clear()
-                available = self.image_files.copy()
-        else:
-            # Если история выключена, используем все изображения
-            available = self.image_files.copy()
+            NoticeDialog.show_warning(self, tr("Warning"), tr("All images have been viewed. Starting over."))
+            self.displayed_history.clear()
+            self.config_manager.clear_history(self.displayed_history)
+            next_image = self.image_sampler.draw()
 
-        if available:
-            next_image = random.choice(available)
+        if next_image:
             self.current_image_path = next_image
             self.display_image(next_image)
             
             if increment:
                 self.accepted_count += 1
-                # Добавляем изображение в сессию только если его там еще нет
-                if next_image not in self.session_images:
-                    self.session_images.append(next_image)
+                # Добавляем изображение в сессию (повторы коллекция пропускает)
+                self.session_images.append(next_image)
                 self.history_index = len(self.session_images) - 1
                 
                 # Добавляем в глобальную историю только если это новое изображение
                 if self.settings["save_history"] and next_image not in self.displayed_history:
                     self.displayed_history.append(next_image)
-                    # Сохраняем историю после добавления нового изображения
-                    self.config_manager.save_history(self.displayed_history)
+                    # Дописываем изображение в журнал истории
+                    self.config_manager.append_history(self.displayed_history, next_image)
                     
                     # Обновляем статистику просмотров для текущей папки
                     current_folder = os.path.dirname(next_image)
@@ -4236,9 +6522,9 @@ class MainWindow(QMainWindow):
             
             # Проверяем, должен ли таймер быть видимым
             if self.settings.get("show_timer", True):
-                self.timer_label.show()
+                self.timer_overlay.show()
             else:
-                self.timer_label.hide()
+                self.timer_overlay.hide()
                 
             # Запускаем таймер, если не в режиме без ограничений
             if not self.settings.get("unlimited_time", False) and not self.is_paused:
@@ -4295,7 +6581,8 @@ class MainWindow(QMainWindow):
                     current_session = self.session_images.copy()
                     
                     # Добавляем изображения из истории в начало сессии
-                    self.session_images = valid_history_images + current_session
+                    self.session_images = ImageCollection(valid_history_images)
+                    self.session_images.extend(current_session)
                     
                     # Устанавливаем индекс на последнее изображение из истории (самое недавнее)
                     self.history_index = len(valid_history_images) - 1
@@ -4372,34 +6659,29 @@ class MainWindow(QMainWindow):
         if not self.image_files:
             return # Нечего пропускать
 
-        available_images = []
-        if self.settings.get("save_history", True):
-            # История включена: нужны изображения не из истории
-            # (кроме текущего, если оно уже в истории - его можно пропустить на новое)
-            seen_images = self.displayed_history.copy()
-            available_images = [img for img in self.image_files if img not in seen_images]
-            
-            if not available_images and self.image_files: 
-                # Если все просмотрены, но файлы есть - начинаем заново
-                NoticeDialog.show_warning(self, tr("Warning"), tr("All images have been viewed. Starting over."))
+        save_history = self.settings.get("save_history", True)
+        # История включена: нужны изображения не из истории, в любом случае - не текущее
+        next_image = self.take_next_image(exclude=self.current_image_path)
+        # Другое изображение есть, только если в папке не одно текущее
+        has_other_images = len(self.image_files) > (1 if self.current_image_path in self.image_files else 0)
+        if next_image is None and save_history and has_other_images:
+            # Если все просмотрены, но файлы есть - начинаем заново
+            NoticeDialog.show_warning(self, tr("Warning"), tr("All images have been viewed. Starting over."))
             self.displayed_history.clear()
-            # Теперь доступны все, кроме текущего (если он единственный)
-            available_images = [img for img in self.image_files if img != self.current_image_path]
-            if not available_images and self.image_files: # Если текущий был единственным
-                available_images = self.image_files[:1] # Берем первый
-        else:
-            # История выключена: нужны все изображения, кроме текущего
-            available_images = [img for img in self.image_files if img != self.current_image_path]
+            self.config_manager.clear_history(self.displayed_history)
+            next_image = self.image_sampler.draw(exclude=self.current_image_path)
+        if next_image is None and not has_other_images:
+            # Текущее изображение единственное - показываем его заново, без предупреждений
+            next_image = self.current_image_path
 
-        if available_images:
-            next_image = random.choice(available_images)
+        if next_image:
             self.current_image_path = next_image # Обновляем путь
             
-            # Добавляем пропущенное в историю, если нужно
-            if self.settings.get("save_history", True) and self.current_image_path not in self.displayed_history:
+            # Добавляем показанное изображение в историю, если нужно
+            if save_history and self.current_image_path not in self.displayed_history:
                  self.displayed_history.append(self.current_image_path)
-                 # Сохраняем историю
-                 self.config_manager.save_history(self.displayed_history)
+                 # Дописываем изображение в журнал истории
+                 self.config_manager.append_history(self.displayed_history, self.current_image_path)
             
             # Отображаем новое изображение
             self.display_image(next_image)
@@ -4433,43 +6715,192 @@ class MainWindow(QMainWindow):
                 return
                 
             self.current_image_path = image_path
+            # Полный размер предыдущего изображения (для зума или буфера обмена) больше не нужен
+            for request_id in (self.full_load_id, self.clipboard_load_id):
+                if request_id is not None:
+                    self.image_service.cancel_request(request_id)
+            self.full_load_id = None
+            self.clipboard_load_id = None
+            self.full_resolution_path = None
                 
-            if image_path in self.pixmap_cache:
-                # Обновляем порядок доступа для LRU
-                if image_path in self.cache_access_order:
-                    self.cache_access_order.remove(image_path)
-                self.cache_access_order.append(image_path)
+            cached = self.image_service.lookup(image_path)
+            if cached is not None:
+                # Изображение уже в кэше - незавершенная загрузка предыдущего больше не нужна
+                self.current_load_id = None
+                self.image_service.cancel_current()
                 
-                self.original_pixmap = self.pixmap_cache[image_path]
-                self.current_pixmap = self.apply_image_effects(self.original_pixmap)
+                self.original_pixmap, full_size = cached
+                if full_size:
+                    self.full_resolution_path = image_path
+                self.current_pixmap = self.original_pixmap
                 self.zoom_factor = 1.0
                 self.update_image_display()
                 self.load_error_streak = 0 # Reset error streak on success
             else:
-                self.cleanup_loader(image_path)
-                loader = ImageLoaderThread(image_path, self)
-                loader.loaded.connect(self.on_image_loaded)
-                loader.error.connect(self.on_image_load_error)
-                self.image_loaders[image_path] = loader
-                loader.start()
+                self.current_load_id = self.image_service.request(
+                    image_path, ImageDecodePool.PRIORITY_CURRENT, self.decode_target_size()
+                )
+            self.prefetch_timer.start()
 
         except Exception as e:
             logging.error(f"Error in display_image for {image_path}: {e}")
             self.handle_load_error(image_path, str(e))
 
+    def take_next_image(self, exclude=None):
+        """Берет следующее изображение из очереди предвыборки, а если она пуста - из колоды"""
+        skip_seen = self.settings.get("save_history", True)
+        while self.upcoming_images:
+            image_path = self.upcoming_images.popleft()
+            # Пока изображение ждало в очереди, его могли удалить или уже показать
+            if image_path == exclude or image_path not in self.image_files:
+                continue
+            if skip_seen and image_path in self.displayed_history:
+                continue
+            return image_path
+        return self.image_sampler.draw(skip_seen=skip_seen, exclude=exclude)
+
+    def prefetch_depth(self):
+        """Сколько изображений готовить заранее: чем дольше декодирование относительно
+        времени показа, тем глубже очередь"""
+        latency = self.image_service.average_decode_time or 0.0
+        if self.settings.get("unlimited_time", False):
+            display_time = 10  # Без таймера переходы ручные, берем типичный темп
+        else:
+            display_time = max(1, self.settings["display_time"])
+        return max(1, min(self.max_prefetch, 1 + math.ceil(2 * latency / display_time)))
+
+    def schedule_prefetch(self):
+        """Заполняет очередь следующих изображений и заранее декодирует их вместе с соседями
+        текущего изображения в сессии"""
+        if not self.image_files or self.is_session_completed:
+            self.clear_prefetch()
+            return
+        
+        depth = self.prefetch_depth()
+        skip_seen = self.settings.get("save_history", True)
+        attempts = 0
+        while len(self.upcoming_images) < depth and attempts < depth * 2:
+            attempts += 1
+            image_path = self.image_sampler.draw(skip_seen=skip_seen, exclude=self.current_image_path)
+            if image_path is None:
+                break
+            if image_path not in self.upcoming_images:
+                self.upcoming_images.append(image_path)
+        
+        wanted = list(self.upcoming_images)[:depth]
+        # Соседи для навигации стрелками назад и вперед по сессии
+        for index in (self.history_index + 1, self.history_index - 1):
+            if 0 <= index < len(self.session_images):
+                wanted.append(self.session_images[index])
+        
+        target_size = self.decode_target_size()
+        requests = {}
+        for image_path in wanted:
+            if image_path == self.current_image_path or image_path in requests:
+                continue
+            request_id = self.prefetch_requests.get(image_path)
+            if request_id is None:
+                if self.image_service.contains(image_path):
+                    continue
+                request_id = self.image_service.request(image_path, ImageDecodePool.PRIORITY_PREFETCH, target_size)
+            requests[image_path] = request_id
+        
+        # Предвыборка, ставшая ненужной, не должна занимать потоки
+        for image_path, request_id in self.prefetch_requests.items():
+            if image_path not in requests:
+                self.image_service.cancel_request(request_id)
+        self.prefetch_requests = requests
+
+    def clear_prefetch(self):
+        """Очищает очередь предвыборки и отменяет ее загрузки"""
+        self.upcoming_images.clear()
+        for request_id in self.prefetch_requests.values():
+            self.image_service.cancel_request(request_id)
+        self.prefetch_requests = {}
+
     def cleanup_loader(self, image_path):
-        """Безопасно очищает загрузчик изображения"""
-        if image_path in self.image_loaders:
-            try:
-                loader = self.image_loaders[image_path]
-                if loader.isRunning():
-                    loader.quit()
-                    if not loader.wait(1000):  # Ждем максимум 1 секунду
-                        loader.terminate()
-                        loader.wait()
-                del self.image_loaders[image_path]
-            except Exception as e:
-                logging.error(f"Error cleaning up loader for {image_path}: {e}")
+        """Отменяет загрузку изображения, не дожидаясь потока декодирования"""
+        self.image_service.cancel(image_path)
+
+    def decode_target_size(self):
+        """Размер для декодирования: квадрат по большей стороне окна в физических пикселях,
+        чтобы изображения хватало и после поворота на 90°"""
+        side = int(max(self.image_canvas.width(), self.image_canvas.height()) * self.devicePixelRatioF())
+        return QSize(side, side)
+
+    def ensure_full_resolution(self):
+        """Догружает полный размер текущего изображения, когда экранного уже не хватает.
+        Возвращает True, если полная версия нашлась в кэше и уже показана"""
+        path = self.current_image_path
+        if (not path or self.original_pixmap is None or self.full_resolution_path == path or
+                self.full_load_id is not None):
+            return False
+        full_pixmap = self.image_service.lookup_full(path)
+        if full_pixmap is not None:
+            # Полный размер уже декодирован, например для буфера обмена
+            self.on_full_resolution_loaded(path, full_pixmap)
+            return True
+        self.full_load_id = self.image_service.request(path, ImageDecodePool.PRIORITY_FULL)
+        return False
+
+    def on_full_resolution_loaded(self, image_path, pixmap):
+        """Подменяет экранную версию полной, сохраняя масштаб и положение"""
+        self.full_resolution_path = image_path
+        self.original_pixmap = pixmap
+        self.current_pixmap = self.original_pixmap
+        self.update_image_display()
+
+    def on_image_decoded(self, request_id, image_path, pixmap, full_size):
+        # Сервис уже положил результат в кэш
+        if request_id == self.clipboard_load_id:
+            self.clipboard_load_id = None
+            if image_path == self.current_image_path:
+                self.set_clipboard_pixmap(self.apply_image_effects(pixmap))
+            # Тот же запрос мог понадобиться и для зума
+            if request_id != self.full_load_id:
+                return
+        if self.prefetch_requests.get(image_path) == request_id:
+            del self.prefetch_requests[image_path]
+            if request_id != self.current_load_id:
+                # Предвыборка: переход к изображению будет мгновенным
+                return
+        if request_id == self.full_load_id:
+            self.full_load_id = None
+            if image_path == self.current_image_path:
+                self.on_full_resolution_loaded(image_path, pixmap)
+            return
+        # Результаты устаревших запросов игнорируем
+        if request_id != self.current_load_id:
+            return
+        self.current_load_id = None
+        self.on_image_loaded(image_path, pixmap, full_size)
+
+    def on_image_decode_failed(self, request_id, image_path, error_message):
+        if request_id == self.clipboard_load_id:
+            # Копируем то, что есть на экране
+            self.clipboard_load_id = None
+            logging.warning(f"Failed to load full resolution of {image_path} for clipboard: {error_message}")
+            if image_path == self.current_image_path and self.current_pixmap:
+                self.set_clipboard_pixmap(self.apply_image_effects(self.current_pixmap))
+            if request_id != self.full_load_id:
+                return
+        if self.prefetch_requests.get(image_path) == request_id:
+            del self.prefetch_requests[image_path]
+            if request_id != self.current_load_id:
+                # Ошибку обработаем, когда до изображения дойдет очередь
+                logging.debug(f"Prefetch of {image_path} failed: {error_message}")
+                return
+        if request_id == self.full_load_id:
+            # Остается экранная версия, повторно полную не запрашиваем
+            self.full_load_id = None
+            if image_path == self.current_image_path:
+                self.full_resolution_path = image_path
+            logging.warning(f"Failed to load full resolution of {image_path}: {error_message}")
+            return
+        if request_id != self.current_load_id:
+            return
+        self.current_load_id = None
+        self.on_image_load_error(image_path, error_message)
 
     def remove_invalid_image(self, image_path):
         """Удаляет недействительное изображение из всех коллекций"""
@@ -4480,12 +6911,9 @@ class MainWindow(QMainWindow):
                 session_index = self.session_images.index(image_path)
             
             # Удаляем из всех коллекций
-            if image_path in self.image_files:
-                self.image_files.remove(image_path)
-            if image_path in self.displayed_history:
-                self.displayed_history.remove(image_path)
-            if image_path in self.pixmap_cache:
-                del self.pixmap_cache[image_path]
+            self.image_files.discard(image_path)
+            in_history = self.displayed_history.discard(image_path)
+            self.image_service.invalidate(image_path)
             
             # Особая обработка для session_images
             if session_index >= 0:
@@ -4498,13 +6926,13 @@ class MainWindow(QMainWindow):
             self.cleanup_loader(image_path)
             
             # Сохраняем обновленную историю
-            if self.settings["save_history"]:
-                self.config_manager.save_history(self.displayed_history)
+            if in_history and self.settings["save_history"]:
+                self.config_manager.remove_from_history(self.displayed_history, image_path)
                 
         except Exception as e:
             logging.error(f"Error removing image {image_path}: {e}")
 
-    def on_image_loaded(self, image_path, pixmap):
+    def on_image_loaded(self, image_path, pixmap, full_size=False):
         try:
             # Reset error streak on successful load
             self.load_error_streak = 0
@@ -4519,18 +6947,10 @@ class MainWindow(QMainWindow):
                 return
 
             self.original_pixmap = pixmap
-            
-            # LRU кэширование - удаляем самый старый элемент
-            if len(self.pixmap_cache) >= self.max_cache_size:
-                if self.cache_access_order:
-                    oldest_key = self.cache_access_order.pop(0)
-                    if oldest_key in self.pixmap_cache:
-                        del self.pixmap_cache[oldest_key]
-            
-            self.pixmap_cache[image_path] = pixmap
-            self.cache_access_order.append(image_path)
+            if full_size:
+                self.full_resolution_path = image_path
 
-            self.current_pixmap = self.apply_image_effects(self.original_pixmap)
+            self.current_pixmap = self.original_pixmap
             self.zoom_factor = 1.0
             self.update_image_display()
 
@@ -4612,12 +7032,10 @@ class MainWindow(QMainWindow):
                 send2trash(normalized_path)
                 
                 # Удаляем из всех коллекций
-                if self.current_image_path in self.image_files:
-                    self.image_files.remove(self.current_image_path)
-                if self.current_image_path in self.displayed_history:
-                    self.displayed_history.remove(self.current_image_path)
-                if self.current_image_path in self.pixmap_cache:
-                    del self.pixmap_cache[self.current_image_path]
+                self.image_files.discard(self.current_image_path)
+                if self.displayed_history.discard(self.current_image_path) and self.settings["save_history"]:
+                    self.config_manager.remove_from_history(self.displayed_history, self.current_image_path)
+                self.image_service.invalidate(self.current_image_path)
                 
                 # Отображаем следующее изображение, если доступно
                 if self.image_files:
@@ -4637,16 +7055,42 @@ class MainWindow(QMainWindow):
             self.bw_button.setIcon(create_themed_icon("resources/bwfilter0.png"))  # Используем обновленную функцию
         
         if self.current_pixmap:
-            self.current_pixmap = self.apply_image_effects(self.original_pixmap)
             self.update_image_display()
         elif hasattr(self, 'menu_logo') and self.menu_logo.isVisible():
             # Применяем эффект к логотипу при отсутствии изображений
             self.menu_logo.setPixmap(self.apply_image_effects(self.menu_logo_pixmap))
 
+    def cycle_value_mode(self):
+        """Переключает этюд на валёры: выкл, 2, 3, 5 тонов, усиление контраста"""
+        self.value_mode = (self.value_mode + 1) % len(VALUE_STUDY_MODES)
+        self.values_button.setIcon(create_themed_icon(
+            "resources/values1.png" if self.value_mode else "resources/values0.png"))
+        self.update_tooltips()
+        
+        if self.current_pixmap:
+            self.update_image_display()
+        elif hasattr(self, 'menu_logo') and self.menu_logo.isVisible():
+            # Применяем эффект к логотипу при отсутствии изображений
+            self.menu_logo.setPixmap(self.apply_image_effects(self.menu_logo_pixmap))
+
+    def toggle_squint(self):
+        """Размывает изображение, чтобы увидеть крупные формы"""
+        active = self.squint_button.isChecked()
+        self.squint_button.setIcon(create_themed_icon(
+            "resources/squint1.png" if active else "resources/squint0.png"))
+        self.image_canvas.set_squint(self.squint_strength if active else 0)
+
+    def change_squint_strength(self, delta):
+        """Меняет силу прищура; размытые копии уже готовы, поэтому мгновенно"""
+        self.squint_strength = max(1, min(ImageCanvas.SQUINT_STRENGTHS, self.squint_strength + delta))
+        if not self.squint_button.isChecked():
+            self.squint_button.setChecked(True)
+        self.toggle_squint()
+        self.show_zoom_indicator(tr("Squint") + f" {self.squint_strength}/{ImageCanvas.SQUINT_STRENGTHS}")
+
     def flip_vertical(self):
         self.flip_v_active = self.flip_v_button.isChecked()
         if self.current_pixmap:
-            self.current_pixmap = self.apply_image_effects(self.original_pixmap)
             self.update_image_display()
         elif hasattr(self, 'menu_logo') and self.menu_logo.isVisible():
             # Применяем эффект к логотипу при отсутствии изображений
@@ -4655,7 +7099,6 @@ class MainWindow(QMainWindow):
     def flip_horizontal(self):
         self.flip_h_active = self.flip_h_button.isChecked()
         if self.current_pixmap:
-            self.current_pixmap = self.apply_image_effects(self.original_pixmap)
             self.update_image_display()
         elif hasattr(self, 'menu_logo') and self.menu_logo.isVisible():
             # Применяем эффект к логотипу при отсутствии изображений
@@ -4664,7 +7107,6 @@ class MainWindow(QMainWindow):
     def rotate_90(self):
         self.rotation_angle = (self.rotation_angle + 90) % 360
         if self.current_pixmap:
-            self.current_pixmap = self.apply_image_effects(self.original_pixmap)
             self.update_image_display()
         elif hasattr(self, 'menu_logo') and self.menu_logo.isVisible():
             # Применяем эффект к логотипу при отсутствии изображений
@@ -4678,11 +7120,16 @@ class MainWindow(QMainWindow):
         self.zoom_factor = 1.0  # Сбрасываем масштаб
         self.zoom_center = None  # Сбрасываем центр зума
         self.bw_button.setChecked(False)
+        self.squint_button.setChecked(False)
+        self.toggle_squint()
+        self.value_mode = 0
+        self.values_button.setIcon(create_themed_icon("resources/values0.png"))
+        self.update_tooltips()
         self.flip_v_button.setChecked(False)
         self.flip_h_button.setChecked(False)
         
         if self.original_pixmap:
-            self.current_pixmap = self.original_pixmap.copy()
+            self.current_pixmap = self.original_pixmap
             self.update_image_display()
         elif hasattr(self, 'menu_logo') and self.menu_logo.isVisible():
             # Восстанавливаем оригинальный логотип
@@ -4694,16 +7141,12 @@ class MainWindow(QMainWindow):
         self.settings["show_timer"] = is_visible
         self.config_manager.save_settings(self.settings)
         
-        timer_container = self.timer_label.parent()
-        
         if is_visible:
             self.show_timer_button.setIcon(create_themed_icon("resources/timer1.png"))  # Используем обновленную функцию
-            timer_container.show()
-            self.timer_label.show()
+            self.timer_overlay.show()
         else:
             self.show_timer_button.setIcon(create_themed_icon("resources/timer0.png"))  # Используем обновленную функцию
-            timer_container.hide()
-            self.timer_label.hide()
+            self.timer_overlay.hide()
 
     def toggle_always_on_top(self):
         """Включает/выключает режим "Поверх всех окон" """
@@ -4773,9 +7216,9 @@ class MainWindow(QMainWindow):
             # Собираем полный текст
             timer_text = f"{break_text}: {self.break_remaining_time} {sec_text}... {skip_text}"
             
-            self.timer_label.setText(timer_text)
-            self.timer_label.setCursor(Qt.CursorShape.PointingHandCursor)
-            self.timer_label.mousePressEvent = lambda event: self.skip_break()
+            self.timer_overlay.setText(timer_text)
+            self.timer_overlay.setCursor(Qt.CursorShape.PointingHandCursor)
+            self.timer_overlay.mousePressEvent = lambda event: self.skip_break()
             
             # Останавливаем таймер, если он активен
             if self.break_timer.isActive():
@@ -4798,9 +7241,9 @@ class MainWindow(QMainWindow):
             
             # Собираем полный текст
             timer_text = f"{completed_text}. {start_new_text}"
-            self.timer_label.setText(timer_text)
-            self.timer_label.setCursor(Qt.CursorShape.PointingHandCursor)
-            self.timer_label.mousePressEvent = lambda event: self.start_new_session()
+            self.timer_overlay.setText(timer_text)
+            self.timer_overlay.setCursor(Qt.CursorShape.PointingHandCursor)
+            self.timer_overlay.mousePressEvent = lambda event: self.start_new_session()
 
     def update_break_countdown(self):
         """Обновление таймера перерыва"""
@@ -4817,7 +7260,7 @@ class MainWindow(QMainWindow):
         
         # Собираем полный текст
         timer_text = f"{break_text}: {self.break_remaining_time} {sec_text}... {skip_text}"
-        self.timer_label.setText(timer_text)
+        self.timer_overlay.setText(timer_text)
         
         if self.break_remaining_time <= 0:
             self.break_timer.stop()
@@ -4899,44 +7342,41 @@ class MainWindow(QMainWindow):
         self.pan_x += delta.x()
         self.pan_y += delta.y()
         
+        # Пока изображение двигают, холст рисует быстро, в полном качестве - после остановки
+        self.image_canvas.begin_interaction()
         self.update_image_display()
 
+    def zoom_offsets(self, fitted_size, zoom):
+        """Смещение видимой области в увеличенном изображении и отступ изображения в окне
+        при заданном масштабе - та же геометрия, что в update_image_display"""
+        view_width = self.image_canvas.width()
+        view_height = self.image_canvas.height()
+        zoomed_width = fitted_size.width() * zoom
+        zoomed_height = fitted_size.height() * zoom
+        pan_x = self.pan_x if zoom > 1.0 else 0
+        pan_y = self.pan_y if zoom > 1.0 else 0
+        x_offset = max(0, min(zoomed_width - view_width, (zoomed_width - view_width) / 2 - pan_x))
+        y_offset = max(0, min(zoomed_height - view_height, (zoomed_height - view_height) / 2 - pan_y))
+        left = (view_width - min(view_width, zoomed_width)) / 2
+        top = (view_height - min(view_height, zoomed_height)) / 2
+        return x_offset, y_offset, left, top
+
     def wheelEvent(self, event):
-        # Получаем позицию мыши относительно окна
-        mouse_pos = event.position().toPoint()
+        # Получаем позицию мыши относительно области изображения
+        mouse_pos = self.image_canvas.mapFrom(self, event.position().toPoint())
         
         # Изменяем масштаб
         delta = event.angleDelta().y()
         prev_zoom = self.zoom_factor
         
-        # Рассчитываем точку, на которую наведен курсор в координатах изображения
-        view_width = self.image_label.width()
-        view_height = self.image_label.height()
-        
-        if self.current_pixmap:
-            scaled_pixmap = self.current_pixmap.scaled(
-                view_width, view_height,
-                Qt.AspectRatioMode.KeepAspectRatio, 
-                Qt.TransformationMode.SmoothTransformation
-            )
-            
-            img_x = (view_width - scaled_pixmap.width()) // 2
-            img_y = (view_height - scaled_pixmap.height()) // 2
-            
-            # Координаты мыши относительно изображения
-            rel_x = (mouse_pos.x() - img_x)
-            rel_y = (mouse_pos.y() - img_y)
-            
-            # Нормализованные координаты (от 0 до 1) в пределах изображения
-            if scaled_pixmap.width() > 0 and scaled_pixmap.height() > 0:
-                norm_x = max(0, min(1, rel_x / scaled_pixmap.width()))
-                norm_y = max(0, min(1, rel_y / scaled_pixmap.height()))
-            else:
-                norm_x = 0.5
-                norm_y = 0.5
+        # Точка изображения под курсором в долях его размера - считаем по геометрии, ничего не масштабируя
+        fitted_size = self.fitted_image_size() if self.current_pixmap else None
+        if fitted_size is not None and not fitted_size.isEmpty():
+            x_offset, y_offset, left, top = self.zoom_offsets(fitted_size, prev_zoom)
+            norm_x = max(0.0, min(1.0, (x_offset + mouse_pos.x() - left) / (fitted_size.width() * prev_zoom)))
+            norm_y = max(0.0, min(1.0, (y_offset + mouse_pos.y() - top) / (fitted_size.height() * prev_zoom)))
         else:
-            norm_x = 0.5
-            norm_y = 0.5
+            fitted_size = None
             
         # Рассчитываем новый масштаб
         if delta > 0:
@@ -4953,30 +7393,35 @@ class MainWindow(QMainWindow):
             self.pan_x = 0
             self.pan_y = 0
         
-        # Регулируем перемещение так, чтобы точка под курсором оставалась на месте
-        if prev_zoom > 1.0 and self.zoom_factor > 1.0 and self.current_pixmap:
-            # Только выполняем коррекцию, если зум был активен до и после изменения
-            # Находим как изменилось соотношение масштабов
-            zoom_ratio = self.zoom_factor / prev_zoom
-            
-            # Корректируем pan на основе нормализованных координат и изменения масштаба
-            scaled_pixmap_width = scaled_pixmap.width()
-            scaled_pixmap_height = scaled_pixmap.height()
-            
-            # Корректируем перемещение, чтобы точка под курсором оставалась на месте
-            old_x_offset = norm_x * scaled_pixmap_width * prev_zoom
-            old_y_offset = norm_y * scaled_pixmap_height * prev_zoom
-            
-            new_x_offset = norm_x * scaled_pixmap_width * self.zoom_factor
-            new_y_offset = norm_y * scaled_pixmap_height * self.zoom_factor
-            
-            self.pan_x -= (new_x_offset - old_x_offset)
-            self.pan_y -= (new_y_offset - old_y_offset)
-        
+        # Подбираем перемещение так, чтобы точка под курсором осталась на месте
+        if self.zoom_factor > 1.0 and fitted_size is not None:
+            zoomed_width = fitted_size.width() * self.zoom_factor
+            zoomed_height = fitted_size.height() * self.zoom_factor
+            _, _, left, top = self.zoom_offsets(fitted_size, self.zoom_factor)
+            x_offset = norm_x * zoomed_width - (mouse_pos.x() - left)
+            y_offset = norm_y * zoomed_height - (mouse_pos.y() - top)
+            self.pan_x = (zoomed_width - self.image_canvas.width()) / 2 - x_offset
+            self.pan_y = (zoomed_height - self.image_canvas.height()) / 2 - y_offset
+        
+        self.image_canvas.begin_interaction()
         self.update_image_display()
         self.show_zoom_indicator()  # Показываем индикатор текущего масштаба
         event.accept()
 
+    def fitted_image_size(self):
+        """Размер изображения, вписанного в окно: большие уменьшаем, маленькие оставляем как есть"""
+        view_width = self.image_canvas.width()
+        view_height = self.image_canvas.height()
+        fitted_size = self.display_size()
+        if fitted_size.width() > view_width or fitted_size.height() > view_height:
+            fitted_size = fitted_size.scaled(view_width, view_height, Qt.AspectRatioMode.KeepAspectRatio)
+        return fitted_size
+
+    def display_size(self):
+        """Размер текущего изображения после поворота"""
+        size = self.current_pixmap.size()
+        return size.transposed() if self.rotation_angle in (90, 270) else size
+
     def update_image_display(self):
         if not hasattr(self, 'current_pixmap') or not self.current_pixmap:
             return
@@ -4988,35 +7433,40 @@ class MainWindow(QMainWindow):
             self.pan_y = 0
         
         # Получаем размер виджета изображения
-        view_width = self.image_label.width()
-        view_height = self.image_label.height()
-        
-        # Создаем новый QPixmap для отображения (оптимизированное создание)
-        final_pixmap = QPixmap(view_width, view_height)
-        final_pixmap.fill(Qt.GlobalColor.transparent)
-        
-        # Масштабируем исходное изображение по размерам окна (оптимизированное масштабирование)
-        if self.current_pixmap.width() > view_width or self.current_pixmap.height() > view_height:
-            scaled_pixmap = self.current_pixmap.scaled(
-                view_width, view_height,
-                Qt.AspectRatioMode.KeepAspectRatio, 
-                Qt.TransformationMode.SmoothTransformation
-            )
-        else:
-            scaled_pixmap = self.current_pixmap  # Используем оригинал если он меньше
+        view_width = self.image_canvas.width()
+        view_height = self.image_canvas.height()
+        
+        # Само масштабирование пикселей делает холст и только при изменении размера
+        fitted_size = self.fitted_image_size()
+        fitted_width = max(1, fitted_size.width())
+        fitted_height = max(1, fitted_size.height())
+        
+        # Экранной версии не хватает при увеличении или в окне, выросшем после ее декодирования
+        # (она вписана в квадрат decode_target_size), - догружаем полную
+        display_size = self.display_size()
+        if ((fitted_width * self.zoom_factor * self.devicePixelRatioF() > display_size.width() or
+             max(display_size.width(), display_size.height()) < self.decode_target_size().width()) and
+                self.ensure_full_resolution()):
+            return  # Полная версия нашлась в кэше и уже показана
         
         # Получаем базовые координаты изображения (центрирование)
-        base_x = (view_width - scaled_pixmap.width()) // 2
-        base_y = (view_height - scaled_pixmap.height()) // 2
+        base_x = (view_width - fitted_width) // 2
+        base_y = (view_height - fitted_height) // 2
         
-        painter = QPainter(final_pixmap)
-        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, True)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+        # Сетка - готовый слой холста, перерисовывается только при изменении этих параметров
+        self.image_canvas.set_overlay_state(
+            (self.grid_h_lines, self.grid_v_lines, self.grid_diagonals, QColor(self.grid_color).rgba())
+            if self.show_grid else None
+        )
+        
+        # Отражения и поворот холст применяет при отрисовке, цветовые эффекты - к нужному размеру
+        orientation = self.orientation_transform(self.current_pixmap.size())
+        effects = self.color_effects()
         
         if self.zoom_factor != 1.0:  # Обрабатываем любой масштаб, отличный от 1.0
-            # Размер масштабированного изображения
-            zoomed_width = int(scaled_pixmap.width() * self.zoom_factor)
-            zoomed_height = int(scaled_pixmap.height() * self.zoom_factor)
+            # Размер масштабированного изображения (дробный - так же считает wheelEvent)
+            zoomed_width = fitted_width * self.zoom_factor
+            zoomed_height = fitted_height * self.zoom_factor
             
             # Расчет видимой области с учетом перемещения
             visible_width = min(view_width, zoomed_width)
@@ -5024,8 +7474,8 @@ class MainWindow(QMainWindow):
             
             if self.zoom_factor > 1.0:
                 # Ограничиваем перемещение только при увеличении
-                max_pan_x = max(0, (zoomed_width - view_width) // 2)
-                max_pan_y = max(0, (zoomed_height - view_height) // 2)
+                max_pan_x = max(0, (zoomed_width - view_width) / 2)
+                max_pan_y = max(0, (zoomed_height - view_height) / 2)
                 self.pan_x = max(-max_pan_x, min(max_pan_x, self.pan_x))
                 self.pan_y = max(-max_pan_y, min(max_pan_y, self.pan_y))
             else:
@@ -5034,50 +7484,52 @@ class MainWindow(QMainWindow):
                 self.pan_y = 0
             
             # Позиция с учетом перемещения и масштаба
-            x_offset = (zoomed_width - view_width) // 2 - int(self.pan_x)
-            y_offset = (zoomed_height - view_height) // 2 - int(self.pan_y)
+            x_offset = (zoomed_width - view_width) / 2 - self.pan_x
+            y_offset = (zoomed_height - view_height) / 2 - self.pan_y
             
             # Обеспечиваем, чтобы offset был неотрицательным
             x_offset = max(0, min(zoomed_width - visible_width, x_offset))
             y_offset = max(0, min(zoomed_height - visible_height, y_offset))
             
+            # Пиксели берем из исходного (не уменьшенного под окно) изображения, чтобы при
+            # увеличении была видна вся детализация
+            display_size = self.display_size()
+            scale_x = display_size.width() / fitted_width
+            scale_y = display_size.height() / fitted_height
+            
             # Исходный прямоугольник (откуда брать пиксели)
             source_rect = QRectF(
-                x_offset / self.zoom_factor,
-                y_offset / self.zoom_factor,
-                visible_width / self.zoom_factor,
-                visible_height / self.zoom_factor
+                x_offset / self.zoom_factor * scale_x,
+                y_offset / self.zoom_factor * scale_y,
+                visible_width / self.zoom_factor * scale_x,
+                visible_height / self.zoom_factor * scale_y
             )
             
             # Целевой прямоугольник (куда рисовать)
             target_rect = QRectF(
-                (view_width - visible_width) // 2,
-                (view_height - visible_height) // 2,
+                (view_width - visible_width) / 2,
+                (view_height - visible_height) / 2,
                 visible_width,
                 visible_height
             )
             
-            # Рисуем изображение
-            painter.drawPixmap(target_rect, scaled_pixmap, source_rect)
+            self.image_canvas.set_image(self.current_pixmap, source_rect, target_rect, fitted_size,
+                                        orientation=orientation, effects=effects)
         else:
-            # Рисуем обычное изображение (без масштабирования)
-            painter.drawPixmap(base_x, base_y, scaled_pixmap)
-        
-        # Если включена сетка, рисуем её поверх изображения
-        if self.show_grid:
-            self.draw_grid(painter, view_width, view_height)
-        
-        painter.end()
-        self.image_label.setPixmap(final_pixmap)
+            # Изображение целиком, вписанное в окно
+            self.image_canvas.set_image(
+                self.current_pixmap, QRectF(QPointF(0, 0), QSizeF(self.display_size())),
+                QRectF(base_x, base_y, fitted_width, fitted_height), fitted_size, fit=True,
+                orientation=orientation, effects=effects
+            )
 
     def draw_grid(self, painter, width, height, offset_x=0, offset_y=0):
         """Рисует сетку на изображении"""
         if not self.show_grid:
             return
         
-        # Получаем цвет сетки из текущей темы
-        colors = theme_manager.get_theme_colors()
-        self.grid_color = QColor(colors['grid_color'])
+        # Цвет сетки берется из темы в apply_theme; перо одно на все линии
+        painter.setPen(QPen(self.grid_color, self.grid_line_width))
         
         # Рисуем горизонтальные линии
         if self.grid_h_lines > 0:
@@ -5086,7 +7538,6 @@ class MainWindow(QMainWindow):
             
             for i in range(1, self.grid_h_lines + 1):
                 y = int(i * h_interval + offset_y)  # Преобразуем в целое число
-                painter.setPen(QPen(self.grid_color, 1))
                 painter.drawLine(int(offset_x), y, int(width + offset_x), y)
                 
         # Рисуем вертикальные линии
@@ -5096,8 +7547,15 @@ class MainWindow(QMainWindow):
             
             for i in range(1, self.grid_v_lines + 1):
                 x = int(i * v_interval + offset_x)  # Преобразуем в целое число
-                painter.setPen(QPen(self.grid_color, 1))
                 painter.drawLine(x, int(offset_y), x, int(height + offset_y))
+        
+        # Рисуем диагонали кадра
+        if self.grid_diagonals:
+            painter.save()
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+            painter.drawLine(QPointF(offset_x, offset_y), QPointF(width + offset_x, height + offset_y))
+            painter.drawLine(QPointF(width + offset_x, offset_y), QPointF(offset_x, height + offset_y))
+            painter.restore()
 
     def closeEvent(self, event):
         """Обрабатывает закрытие главного окна"""
@@ -5105,16 +7563,17 @@ class MainWindow(QMainWindow):
         if hasattr(self, 'scanner_thread') and self.scanner_thread is not None and self.scanner_thread.isRunning():
             logging.debug("Requesting scanner thread to stop...")
             self.scanner_thread.stop()
-
-        # Stop all image loaders
-        if hasattr(self, 'image_loaders'):
-            for loader in list(self.image_loaders.values()):
-                if loader is not None:
-                    try:
-                        loader.quit()
-                    except Exception as e:
-                        logging.error(f"Error stopping loader: {e}")
-            self.image_loaders.clear()
+            self.scanner_thread.wait(2000)
+        if hasattr(self, 'folder_watcher'):
+            refresh_thread = self.folder_watcher.refresh_thread
+            self.folder_watcher.stop()
+            if refresh_thread is not None:
+                refresh_thread.wait(2000)
+
+        # Stop image decoding
+        if hasattr(self, 'image_service'):
+            self.current_load_id = None
+            self.image_service.shutdown()
         
         # Stop UI timers
         if hasattr(self, 'countdown_timer'):
@@ -5126,41 +7585,55 @@ class MainWindow(QMainWindow):
         if hasattr(self, 'system_theme_check_timer'):
             self.system_theme_check_timer.stop()
         
-        # Save history if enabled
-        if hasattr(self, 'settings') and hasattr(self, 'displayed_history') and hasattr(self, 'config_manager') and self.settings.get("save_history", True):
-            self.config_manager.save_history(self.displayed_history)
+        # History is journaled as it changes, only finish pending writes
+        if hasattr(self, 'config_manager'):
+            self.config_manager.close()
         
         logging.debug("Main window closing")
         event.accept()
 
     def copy_image_to_clipboard(self):
-        """Копирует текущее изображение в буфер обмена"""
-        if hasattr(self, 'current_pixmap') and self.current_pixmap:
-            clipboard = QApplication.clipboard()
-            clipboard.setPixmap(self.current_pixmap)
-            
-            # Получаем цвета темы
-            colors = theme_manager.get_theme_colors()
-            
-            # Показываем всплывающее сообщение об успешном копировании
-            status_bar = QStatusBar(self)
-            status_bar.setStyleSheet(f"""
-                QStatusBar {{
-                    background-color: {colors['background_secondary']};
-                    color: {colors['text']};
-                    border: 1px solid {colors['border']};
-                    border-radius: 4px;
-                    padding: 4px;
-                    font-size: 12px;
-                }}
-            """)
-            status_bar.showMessage(tr("Image copied to clipboard"), 2000)
-            status_bar.move(10, self.height() - 40)
-            status_bar.setFixedWidth(200)
-            status_bar.show()
-            
-            # Скрываем сообщение через 2 секунды
-            QTimer.singleShot(2000, status_bar.hide)
+        """Копирует текущее изображение в буфер обмена в полном размере"""
+        if not (hasattr(self, 'current_pixmap') and self.current_pixmap):
+            return
+        path = self.current_image_path
+        if path and self.original_pixmap is not None and self.full_resolution_path != path:
+            full_pixmap = self.image_service.lookup_full(path)
+            if full_pixmap is not None:
+                self.set_clipboard_pixmap(self.apply_image_effects(full_pixmap))
+                return
+            # На экране уменьшенная версия - полный размер декодируется в фоне, копируем по готовности
+            self.clipboard_load_id = self.image_service.request(path, ImageDecodePool.PRIORITY_FULL)
+            return
+        self.set_clipboard_pixmap(self.apply_image_effects(self.current_pixmap))
+
+    def set_clipboard_pixmap(self, pixmap):
+        """Помещает изображение в буфер обмена и показывает сообщение"""
+        clipboard = QApplication.clipboard()
+        clipboard.setPixmap(pixmap)
+        
+        # Получаем цвета темы
+        colors = theme_manager.get_theme_colors()
+        
+        # Показываем всплывающее сообщение об успешном копировании
+        status_bar = QStatusBar(self)
+        status_bar.setStyleSheet(f"""
+            QStatusBar {{
+                background-color: {colors['background_secondary']};
+                color: {colors['text']};
+                border: 1px solid {colors['border']};
+                border-radius: 4px;
+                padding: 4px;
+                font-size: 12px;
+            }}
+        """)
+        status_bar.showMessage(tr("Image copied to clipboard"), 2000)
+        status_bar.move(10, self.height() - 40)
+        status_bar.setFixedWidth(200)
+        status_bar.show()
+        
+        # Скрываем сообщение через 2 секунды
+        QTimer.singleShot(2000, status_bar.hide)
         
     def zoom_in(self):
         """Увеличивает масштаб на 10%"""
@@ -5194,10 +7667,12 @@ class MainWindow(QMainWindow):
         self.update_image_display()
         self.show_zoom_indicator()
 
-    def show_zoom_indicator(self):
-        """Показывает индикатор текущего масштаба"""
-        zoom_percent = int(self.zoom_factor * 100)
-        self.zoom_indicator.setText(f"{zoom_percent}%")
+    def show_zoom_indicator(self, text=None):
+        """Показывает индикатор текущего масштаба (или другого значения, например силы прищура)"""
+        if text is None:
+            zoom_percent = int(self.zoom_factor * 100)
+            text = f"{zoom_percent}%"
+        self.zoom_indicator.setText(text)
         
         # Позиционируем индикатор в правом нижнем углу
         self.zoom_indicator.adjustSize()
@@ -5256,12 +7731,16 @@ class MainWindow(QMainWindow):
         self.setStyleSheet(styles["main_window"])
         self.central_widget.setStyleSheet(styles["main_window"])
         
-        # Применяем стиль к изображению
-        self.image_label.setStyleSheet(f"background-color: {colors['background']};")
+        # Применяем цвет фона к области изображения
+        self.image_canvas.set_background(colors['background'])
         
-        # Применяем стиль к таймеру
-        timer_container = self.timer_label.parent()
-        timer_container.setStyleSheet(styles["timer_label"])
+        # Применяем стиль к таймеру: цвета и шрифт задаются один раз, а не на каждом тике
+        self.timer_overlay.set_style(
+            theme_qcolor(colors['timer_background'], QColor(0, 0, 0, 120)),
+            theme_qcolor(colors['overlay_text'], QColor(Qt.GlobalColor.white)),
+            [family.strip().strip('"') for family in font_family.split(",")],
+            font_sizes['label']
+        )
         
         # Применяем стиль к индикатору зума
         self.zoom_indicator.setStyleSheet(styles["zoom_indicator"])
@@ -5272,7 +7751,8 @@ class MainWindow(QMainWindow):
         
         # Применяем стиль ко всем кнопкам инструментов, включая кнопку настроек
         for button in [self.open_file_button, self.copy_image_button, self.delete_button,
-                       self.grid_button, self.bw_button, self.flip_v_button,
+                       self.grid_button, self.bw_button, self.values_button, self.squint_button,
+                       self.flip_v_button,
                        self.flip_h_button, self.rotate_button, self.restore_button,
                        self.show_timer_button, self.always_on_top_button,
                        self.settings_button]:
@@ -5281,7 +7761,7 @@ class MainWindow(QMainWindow):
             
         # Применяем стиль к контейнеру кнопок
         for control in self.overlay_controls:
-            if isinstance(control, QWidget) and control is not timer_container:
+            if isinstance(control, QWidget) and control is not self.timer_overlay:
                 control.setStyleSheet(styles["buttons_container"])
         
         # Обновляем иконки в соответствии с темой
@@ -5294,6 +7774,8 @@ class MainWindow(QMainWindow):
         self.delete_button.setIcon(create_themed_icon("resources/delete0.png"))
         self.grid_button.setIcon(create_themed_icon("resources/grid1.png" if self.show_grid else "resources/grid0.png"))
         self.bw_button.setIcon(create_themed_icon("resources/bwfilter1.png" if self.is_bw else "resources/bwfilter0.png"))
+        self.values_button.setIcon(create_themed_icon("resources/values1.png" if self.value_mode else "resources/values0.png"))
+        self.squint_button.setIcon(create_themed_icon("resources/squint1.png" if self.squint_button.isChecked() else "resources/squint0.png"))
         self.flip_v_button.setIcon(create_themed_icon("resources/flipv.png"))
         self.flip_h_button.setIcon(create_themed_icon("resources/fliph.png"))
         self.rotate_button.setIcon(create_themed_icon("resources/rotate.png"))
@@ -5314,14 +7796,7 @@ class MainWindow(QMainWindow):
         
         # Восстанавливаем правильное состояние видимости таймера
         is_visible = self.settings.get("show_timer", True)
-        timer_container = self.timer_label.parent()
-        
-        if is_visible:
-            timer_container.show()
-            self.timer_label.show()
-        else:
-            timer_container.hide()
-            self.timer_label.hide()
+        self.timer_overlay.setVisible(is_visible)
         
         # Применяем текущую системную тему, если она выбрана
         if self.settings.get("theme") == "system":
@@ -5336,14 +7811,7 @@ class MainWindow(QMainWindow):
             else:
                 # Окно восстановлено
                 is_visible = self.settings.get("show_timer", True)
-                timer_container = self.timer_label.parent()
-                
-                if is_visible:
-                    timer_container.show()
-                    self.timer_label.show()
-                else:
-                    timer_container.hide()
-                    self.timer_label.hide()
+                self.timer_overlay.setVisible(is_visible)
                 
                 # Если окно было восстановлено или развернуто, проверяем системную тему
                 if self.settings.get("theme") == "system":
@@ -5367,35 +7835,49 @@ class MainWindow(QMainWindow):
         if self.settings.get("theme") == "system":
             self.check_and_apply_system_theme()
 
-class ImageLoaderThread(QThread):
-    loaded = pyqtSignal(str, QPixmap)
-    error = pyqtSignal(str, str)
-
-    def __init__(self, image_path, parent=None):
-        super().__init__(parent)
+# Декодирование одного изображения в пуле потоков
+class ImageDecodeTask(QRunnable):
+    """Decodes one image into a QImage on an ImageDecodePool worker.
+
+    QPixmap must not be created outside the GUI thread, so the worker hands
+    over a QImage already converted to a format that paints without
+    conversion; the GUI side only calls QPixmap.fromImage. With a target
+    size the image is decoded straight to that size through
+    QImageReader.setScaledSize (JPEG downscales in the DCT domain), so
+    decode time and memory follow the screen, not the file; the pool's
+    disk cache is tried first. Cancellation
+    is cooperative: the task checks `cancelled` before and after decoding
+    and then simply reports nothing.
+    """
+
+    def __init__(self, pool, request_id, image_path, priority, target_size=None):
+        super().__init__()
+        # Задачей владеет ImageDecodePool, иначе tryTake вернет уже удаленный объект
+        self.setAutoDelete(False)
+        self.pool = pool
+        self.request_id = request_id
         self.image_path = image_path
-        self._is_running = True
-
-    def quit(self):
-        self._is_running = False
-        super().quit()
+        self.priority = priority
+        self.target_size = target_size  # QSize, в который нужно вписать изображение; None - полный размер
+        self.key = (image_path, target_size is None)
+        self.cancelled = False
+        self.duration = None  # время декодирования в секундах, для оценки глубины предвыборки
+        self.source_size = QSize()
 
     def load_svg(self, path):
-        if not self._is_running:
-            return None
         try:
             renderer = QSvgRenderer(path)
             if not renderer.isValid():
                 return None
 
-            image = QImage(800, 600, QImage.Format.Format_ARGB32)
+            image = QImage(800, 600, QImage.Format.Format_ARGB32_Premultiplied)
             image.fill(Qt.GlobalColor.transparent)
             
             painter = None
             try:
                 painter = QPainter(image)
                 renderer.render(painter)
-                return QPixmap.fromImage(image)
+                return image
             finally:
                 if painter:
                     painter.end()
@@ -5403,41 +7885,302 @@ class ImageLoaderThread(QThread):
             logging.error(f"Error loading SVG {path}: {e}")
             return None
 
+    def read_image(self, path):
+        reader = QImageReader(path)
+        source_size = self.source_size = reader.size()
+        if (self.target_size is not None and source_size.isValid() and
+                (source_size.width() > self.target_size.width() or
+                 source_size.height() > self.target_size.height())):
+            reader.setScaledSize(source_size.scaled(self.target_size, Qt.AspectRatioMode.KeepAspectRatio))
+        image = reader.read()
+        if image.isNull():
+            return None
+        # Палитровые, 16-битные, CMYK и прочие форматы переводим здесь, а не при каждой отрисовке
+        if image.hasAlphaChannel():
+            target_format = QImage.Format.Format_ARGB32_Premultiplied
+        else:
+            target_format = QImage.Format.Format_RGB32
+        if image.format() != target_format:
+            image = image.convertToFormat(target_format)
+        return image
+
     def run(self):
         try:
-            if not self._is_running:
+            if self.cancelled:
                 return
 
             if not os.path.exists(self.image_path):
-                self.error.emit(self.image_path, "File doesn't exist")
+                self.pool.failed.emit(self.request_id, self.image_path, "File doesn't exist")
                 return
 
             if not os.access(self.image_path, os.R_OK):
-                self.error.emit(self.image_path, "No access to file")
+                self.pool.failed.emit(self.request_id, self.image_path, "No access to file")
                 return
 
+            started = time.monotonic()
             ext = os.path.splitext(self.image_path)[1].lower()
-            
-            if not self._is_running:
-                return
-                
+            disk_cache = self.pool.disk_cache if self.target_size is not None else None
+            cached = None
             if ext == '.svg':
-                pixmap = self.load_svg(self.image_path)
+                image = self.load_svg(self.image_path)
             else:
-                pixmap = QPixmap(self.image_path)
+                cached = disk_cache.lookup(self.image_path, self.target_size) if disk_cache else None
+                if cached is not None:
+                    image, self.source_size = cached
+                else:
+                    image = self.read_image(self.image_path)
+            self.duration = time.monotonic() - started
 
-            if not self._is_running:
+            if self.cancelled:
                 return
 
-            if pixmap is None or pixmap.isNull():
-                self.error.emit(self.image_path, "Failed to load image")
+            if image is None or image.isNull():
+                self.pool.failed.emit(self.request_id, self.image_path, "Failed to load image")
                 return
 
-            self.loaded.emit(self.image_path, pixmap)
+            if not self.source_size.isValid():
+                # SVG и файлы без размера в заголовке декодируются целиком
+                self.source_size = image.size()
+            self.pool.decoded.emit(self.request_id, self.image_path, image, self.source_size)
+            
+            # Долгое декодирование сохраняем на диск уже после показа, но только уменьшенное:
+            # изображение во весь исходный размер должно приходить из оригинала, а не из JPEG
+            downscaled = (image.width() < self.source_size.width() or
+                          image.height() < self.source_size.height())
+            if (disk_cache is not None and cached is None and ext != '.svg' and downscaled and
+                    self.duration >= DiskImageCache.MIN_DECODE_TIME):
+                disk_cache.store(self.image_path, image, self.source_size)
 
         except Exception as e:
-            if self._is_running:
-                self.error.emit(self.image_path, str(e))
+            if not self.cancelled:
+                self.pool.failed.emit(self.request_id, self.image_path, str(e))
+        finally:
+            self.pool.task_done.emit(self.request_id)
+
+# Ограниченный пул декодирования с приоритетами
+class ImageDecodePool(QObject):
+    """Bounded image decoding pool with priorities and cancellation.
+
+    Requests for the image on screen outrank prefetching, which outranks
+    background work. Screen-sized and full-size decodes of one file are
+    separate tasks. A new PRIORITY_CURRENT request cancels the previous
+    ones, so holding the arrow key never piles up decodes; results carry
+    the request id so the caller can drop anything that is not the latest.
+    PRIORITY_FULL is for full-size decodes the user asked for (zoom,
+    clipboard): they run first and neither cancel nor are cancelled by
+    that sweep, only explicitly by request id.
+    The pool also keeps a moving average of decode time, which the window
+    uses to decide how far ahead to prefetch. With a DiskImageCache,
+    screen-sized requests are served from it when possible.
+    """
+    PRIORITY_BACKGROUND = 0
+    PRIORITY_PREFETCH = 1
+    PRIORITY_CURRENT = 2
+    PRIORITY_FULL = 3
+
+    decoded = pyqtSignal(int, str, QImage, QSize)  # request id, путь, изображение, размер исходного файла
+    failed = pyqtSignal(int, str, str)
+    task_done = pyqtSignal(int)
+
+    def __init__(self, parent=None, max_threads=None, disk_cache=None):
+        super().__init__(parent)
+        self.disk_cache = disk_cache  # DiskImageCache или None
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads or max(2, min(4, QThread.idealThreadCount())))
+        self.tasks = {}    # request id -> задача, пока она не завершилась
+        self.by_key = {}   # (путь, полный размер) -> request id активной (не отмененной) задачи
+        self.next_id = 0
+        self.average_decode_time = None  # экспоненциальное скользящее среднее, сек
+        self.task_done.connect(self.on_task_done)
+
+    def request(self, image_path, priority, target_size=None):
+        """Queues a decode and returns its request id; repeated requests share one task"""
+        request_id = self.by_key.get((image_path, target_size is None))
+        if request_id is not None:
+            task = self.tasks[request_id]
+            # Задачу, ожидающую в очереди, переставляем с новым приоритетом
+            if priority > task.priority and self.pool.tryTake(task):
+                self.pool.start(task, priority)
+            task.priority = max(task.priority, priority)
+        else:
+            self.next_id += 1
+            request_id = self.next_id
+            task = ImageDecodeTask(self, request_id, image_path, priority, target_size)
+            self.tasks[request_id] = task
+            self.by_key[task.key] = request_id
+            self.pool.start(task, priority)
+
+        if priority == self.PRIORITY_CURRENT:
+            # Показывается только последнее изображение, прежние запросы больше не нужны
+            for other in list(self.tasks.values()):
+                if other is not task and other.priority == self.PRIORITY_CURRENT:
+                    self.cancel_task(other)
+        return request_id
+
+    def cancel_task(self, task):
+        task.cancelled = True
+        if self.by_key.get(task.key) == task.request_id:
+            del self.by_key[task.key]
+        if self.pool.tryTake(task):
+            # Задача еще не начиналась и уже не начнется
+            self.tasks.pop(task.request_id, None)
+
+    def cancel(self, image_path):
+        """Cancels the decodes of a file, except PRIORITY_FULL ones, which are cancelled by id"""
+        for key in ((image_path, False), (image_path, True)):
+            request_id = self.by_key.get(key)
+            if request_id is not None and self.tasks[request_id].priority != self.PRIORITY_FULL:
+                self.cancel_task(self.tasks[request_id])
+
+    def cancel_current(self):
+        for task in list(self.tasks.values()):
+            if task.priority == self.PRIORITY_CURRENT:
+                self.cancel_task(task)
+
+    def cancel_request(self, request_id):
+        """Cancels a prefetch, background or full-size request; a request promoted to current is kept"""
+        task = self.tasks.get(request_id)
+        if task is not None and task.priority != self.PRIORITY_CURRENT:
+            self.cancel_task(task)
+
+    def on_task_done(self, request_id):
+        task = self.tasks.pop(request_id, None)
+        if task is None:
+            return
+        if self.by_key.get(task.key) == request_id:
+            del self.by_key[task.key]
+        if task.duration is not None and not task.cancelled:
+            if self.average_decode_time is None:
+                self.average_decode_time = task.duration
+            else:
+                self.average_decode_time += 0.3 * (task.duration - self.average_decode_time)
+
+    def shutdown(self, timeout=2000):
+        for task in list(self.tasks.values()):
+            self.cancel_task(task)
+        self.pool.clear()
+        self.pool.waitForDone(timeout)
+
+# Единая точка получения изображений: главное окно, превью в настройках, буфер обмена
+class ImageService(QObject):
+    """Owns image decoding and every in-memory copy of decoded images.
+
+    Thumbnails, screen-sized and full-resolution pixmaps share one
+    PixmapCache, so a single budget covers the whole process and a picture
+    decoded for one caller is reused by the others. Decodes go through the
+    ImageDecodePool (and the disk cache behind it), thumbnails through the
+    ThumbnailCache. Results are converted to QPixmap once, cached and then
+    announced: `loaded` for decode requests by request id, `thumbnail_ready`
+    for thumbnails by path. ImageService.shared() returns the service
+    created last, which is the main window's.
+    """
+    loaded = pyqtSignal(int, str, QPixmap, bool)  # request id, путь, изображение, полный ли размер
+    failed = pyqtSignal(int, str, str)
+    thumbnail_ready = pyqtSignal(str, QPixmap)
+    thumbnail_failed = pyqtSignal(str)
+
+    _shared = None
+
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            cls(parent=QApplication.instance())
+        return cls._shared
+
+    def __init__(self, memory_budget=None, disk_cache=None, parent=None):
+        super().__init__(parent)
+        ImageService._shared = self
+        self.cache = PixmapCache(memory_budget)
+        self.disk_cache = disk_cache
+        self.decode_pool = ImageDecodePool(self, disk_cache=disk_cache)
+        self.decode_pool.decoded.connect(self.on_decoded)
+        self.decode_pool.failed.connect(self.failed)
+        self.thumbnails = ThumbnailCache(self)
+        self.thumbnails.ready.connect(self.on_thumbnail_ready)
+        self.thumbnails.failed.connect(self.thumbnail_failed)
+        self.whole_thumbnails = set()  # Миниатюры, которые и есть изображение целиком
+
+    @property
+    def average_decode_time(self):
+        return self.decode_pool.average_decode_time
+
+    def lookup(self, image_path):
+        """Returns (pixmap, is_full_resolution) for a cached displayable version, or None"""
+        cached = self.cache.lookup(image_path)
+        if cached is None:
+            return None
+        return cached[0], cached[1] == PixmapCache.VARIANT_FULL
+
+    def lookup_full(self, image_path):
+        cached = self.cache.lookup(image_path, (PixmapCache.VARIANT_FULL,))
+        return cached[0] if cached is not None else None
+
+    def contains(self, image_path):
+        return self.cache.contains(image_path)
+
+    def request(self, image_path, priority, target_size=None):
+        """Queues a decode (full size when target_size is None) and returns its request id"""
+        return self.decode_pool.request(image_path, priority, target_size)
+
+    def on_decoded(self, request_id, image_path, image, source_size):
+        # Формат уже подготовлен в потоке декодирования, здесь только дешевое преобразование
+        pixmap = QPixmap.fromImage(image)
+        # Экранная версия файла, не превышающего экран, и есть полный размер (стороны сравниваем
+        # без учета ориентации: размер в заголовке может быть до поворота по EXIF)
+        image_sides = sorted((image.width(), image.height()))
+        source_sides = sorted((source_size.width(), source_size.height()))
+        full_size = image_sides[0] >= source_sides[0] and image_sides[1] >= source_sides[1]
+        self.cache.put(image_path, pixmap, PixmapCache.VARIANT_FULL if full_size else PixmapCache.VARIANT_SCREEN)
+        self.loaded.emit(request_id, image_path, pixmap, full_size)
+
+    def cancel_request(self, request_id):
+        self.decode_pool.cancel_request(request_id)
+
+    def cancel(self, image_path):
+        self.decode_pool.cancel(image_path)
+
+    def cancel_current(self):
+        self.decode_pool.cancel_current()
+
+    def thumbnail(self, image_path, width):
+        """Returns a cached thumbnail at least `width` wide; otherwise starts loading one and returns None"""
+        cached = self.cache.lookup(image_path, (PixmapCache.VARIANT_THUMBNAIL,))
+        if cached is not None and (cached[0].width() >= width or image_path in self.whole_thumbnails):
+            return cached[0]
+        self.thumbnails.request(image_path, width)
+        return None
+
+    def on_thumbnail_ready(self, image_path, image):
+        pixmap = QPixmap.fromImage(image)
+        if image.text("Thumb::Full") == "1":
+            self.whole_thumbnails.add(image_path)
+        self.cache.put(image_path, pixmap, PixmapCache.VARIANT_THUMBNAIL)
+        self.thumbnail_ready.emit(image_path, pixmap)
+
+    def invalidate(self, image_path):
+        self.cache.invalidate(image_path)
+        self.whole_thumbnails.discard(image_path)
+
+    def invalidate_many(self, image_paths):
+        for image_path in image_paths:
+            self.invalidate(image_path)
+
+    def invalidate_folders(self, folders):
+        """Drops cached images of folders whose listing changed: a file saved over
+        (write to a temp file and rename) keeps its path but not its content"""
+        self.invalidate_many(self.cache.cached_paths(folders))
+
+    def clear(self):
+        self.cache.clear()
+        self.whole_thumbnails.clear()
+
+    def shutdown(self):
+        self.decode_pool.shutdown()
+        self.thumbnails.shutdown()
+        logging.info(f"Pixmap cache: {self.cache.stats()}")
+        if self.disk_cache is not None:
+            self.disk_cache.stop()
+            logging.info(f"Disk image cache: {self.disk_cache.stats()}")
 
 class DeleteConfirmationDialog(QDialog):
     def __init__(self, parent=None):